@@ -2,8 +2,16 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from scipy.optimize import curve_fit, lsq_linear
+from scipy.special import expit
+from scipy import sparse
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import glob
 
 def make_period_datetimes(simulation_start_date):
   datetime_dict = {}
@@ -30,500 +38,694 @@ def make_period_datetimes(simulation_start_date):
       period_range[str(x)][index_use] = period_range[str(x)][index_use].astype(int)
   return datetime_dict, period_range
 
-def load_facilities(facility_list, start_value, end_value, regional_name = 'none', show_plot = False):
+def make_content_cache_key(file_list, cache_settings):
+  #the cache key is a hash of the contents of each source file and of the settings used to make the cached values
+  #settings can be numbers, strings, dates, numpy arrays (hashed by their values), or lists/dictionaries of them
+  content_hash = hashlib.sha1()
+  for file_name in file_list:
+    content_hash.update(os.path.basename(file_name).encode('utf-8'))
+    with open(file_name, 'rb') as source_file:
+      for file_block in iter(lambda: source_file.read(1048576), b''):
+        content_hash.update(file_block)
+  content_hash.update(json.dumps(cache_settings, default = describe_cache_setting).encode('utf-8'))
+  return content_hash.hexdigest()
 
-  #load statewide hospital admissions data (monthly files)
-  ender_list = ['1016', '1102', '1201', '0104', '0201']
-  hospital_admissions = pd.DataFrame()
-  counter = 0
-  #join hospital input files
-  for x in ender_list:
-    hospital_admissions_int = pd.read_csv('state_hospital_data/UNC_Data_Request_' + x + '.csv', encoding = 'latin')
-    if counter > 1:
-      hospital_admissions_int['hospital'] = hospital_admissions_int['hospital_name']
-    counter += 1
-    
-    hospital_admissions = pd.concat([hospital_admissions, hospital_admissions_int])
+def describe_cache_setting(setting_value):
+  #convert settings that json can't write into a string for make_content_cache_key
+  if isinstance(setting_value, np.ndarray):
+    array_values = np.ascontiguousarray(setting_value)
+    return str(array_values.dtype) + str(array_values.shape) + hashlib.sha1(array_values.tobytes()).hexdigest()
+  if isinstance(setting_value, np.generic):
+    return setting_value.item()
+  return str(setting_value)
 
-  #reset indices, set date string to datetime
-  hospital_admissions = hospital_admissions.reset_index()
-  hospital_admissions['Date'] = pd.to_datetime(hospital_admissions['Date'])
-  
-  #sort admissions by date
-  sorted_all_admissions = hospital_admissions.sort_values(by = 'Date')
-  sorted_all_admissions = sorted_all_admissions.reset_index()
-    
-  daily_hospital_census = {}
-  admission_types = ['admissions', 'covid_census', 'total_census', 'total_capacity', 'covid_icu_census', 'total_icu_census', 'total_icu_capacity', 'total_vent_census', 'total_vent_capacity', 'total_surge']
-  for x in admission_types:
-    daily_hospital_census[x] = {}
-  admissions_date = {}
-
-  #loop through hospital list
-  for facility in facility_list:
-    #find hospital-specific admissions
-    ind_admissions = hospital_admissions[hospital_admissions['hospital'] == facility]
-    ind_admissions.loc[:,'Date'] = pd.to_datetime(ind_admissions.loc[:,'Date'])
-    if len(ind_admissions['Date']) > 0:
-      #find bounds of admissions timeseries
-      sorted_admissions = ind_admissions.sort_values(by = 'Date')
-      sorted_admissions = sorted_admissions.reset_index()
-      start_date = sorted_all_admissions['Date'][0]
-      end_date = sorted_all_admissions['Date'][len(sorted_all_admissions['Date']) - 1]
-      total_length = end_date - start_date
-      #initialize census timeseries
-      for admission_type in admission_types:
-        daily_hospital_census[admission_type][facility] = np.zeros(total_length.days + 1)    
-      
-      #set admission datetime index
-      admissions_date[facility] = []
-      for n in range(0, total_length.days + 1):
-        daily_dates = start_date + timedelta(n)
-        admissions_date[facility].append(daily_dates)
-        
-      #loop through admission series and set census dictionary timeseries'
-      for index, row in sorted_admissions.iterrows():
-        index_val = row['Date'] - start_date
-        if pd.isnull(row['Number of new patients admitted to an inpatient bed who had confirmed COVID-19 at the time of admission in the past 24 hours']):
-          if pd.isnull(row['Number of new patients admitted to an inpatient bed who had suspected COVID-19 at the time of admission in the past 24 hours']):
-            daily_hospital_census['admissions'][facility][index_val.days] += 0.0
-        else:
-          #use suspected COVID cases if that data is available, otherwise use confirmed COVID cases
-          if pd.isnull(row['Number of new patients admitted to an inpatient bed who had suspected COVID-19 at the time of admission in the past 24 hours']):
-            daily_hospital_census['admissions'][facility][index_val.days] = (row['Number of new patients admitted to an inpatient bed who had confirmed COVID-19 at the time of admission in the past 24 hours'])
-          else:
-            daily_hospital_census['admissions'][facility][index_val.days] = (row['Number of new patients admitted to an inpatient bed who had confirmed COVID-19 at the time of admission in the past 24 hours']) #+ (row['Number of new patients admitted to an inpatient bed who had suspected COVID-19 at the time of admission in the past 24 hours'])
-        #Total COVID patients in the hospital
-        if pd.notna(row['Number of COVID-19 Positive Patients In Hospital']):
-          daily_hospital_census['covid_census'][facility][index_val.days] = row['Number of COVID-19 Positive Patients In Hospital']
-        #Total patients in the hospital
-        if pd.notna(row['Inpatient Census (all bed types)']):
-          daily_hospital_census['total_census'][facility][index_val.days] = row['Inpatient Census (all bed types)']
-
-        #Total hospital capacity
-        if pd.notna(row['Staffed Inpatient Capacity (all bed types)']):
-          daily_hospital_census['total_capacity'][facility][index_val.days] = row['Staffed Inpatient Capacity (all bed types)']
-
-        #Total COVID patients in the ICU
-        if pd.notna(row['Number of COVID-19 Positive Adults in ICU']):
-          daily_hospital_census['covid_icu_census'][facility][index_val.days] = row['Number of COVID-19 Positive Adults in ICU']
-          
-        #Total patients in the ICU
-        if pd.notna(row['Adult ICU Census']):
-          if facility == 'Duke University Hospital' and index_val.days > 216 and index_val.days < 264:
-            daily_hospital_census['total_icu_census'][facility][index_val.days] = row['Adult ICU Staffed Bed Capacity']
-          else:
-            daily_hospital_census['total_icu_census'][facility][index_val.days] = row['Adult ICU Census']
-            
-        #Total ICU capacity
-        if pd.notna(row['Adult ICU Staffed Bed Capacity']):
-          daily_hospital_census['total_icu_capacity'][facility][index_val.days] = row['Adult ICU Staffed Bed Capacity']
+def pack_artifacts(artifact_dict, packed_arrays, prefix = ''):
+  #this function flattens a nested dictionary of arrays/numbers into named arrays for np.savez ('key/key/...')
+  #dictionaries of numbers are packed into one array of keys ('@keys') and one array of values ('@values'),
+  #lists are saved with '@list', pandas series with '@series' (values) + '@index', and empty dictionaries with '@empty'
+  for artifact_key in artifact_dict:
+    artifact_name = prefix + artifact_key
+    artifact_value = artifact_dict[artifact_key]
+    if isinstance(artifact_value, dict):
+      if len(artifact_value) == 0:
+        packed_arrays[artifact_name + '/@empty'] = np.zeros(0)
+      elif all(np.isscalar(x) and not isinstance(x, str) for x in artifact_value.values()):
+        packed_arrays[artifact_name + '/@keys'] = np.asarray(list(artifact_value.keys()), dtype = str)
+        packed_arrays[artifact_name + '/@values'] = np.asarray(list(artifact_value.values()))
+      else:
+        pack_artifacts(artifact_value, packed_arrays, prefix = artifact_name + '/')
+    elif isinstance(artifact_value, pd.Series):
+      packed_arrays[artifact_name + '/@series'] = artifact_value.to_numpy()
+      packed_arrays[artifact_name + '/@index'] = artifact_value.index.to_numpy()
+    elif isinstance(artifact_value, list):
+      packed_arrays[artifact_name + '/@list'] = np.asarray(artifact_value)
+    else:
+      packed_arrays[artifact_name] = np.asarray(artifact_value)
+  return packed_arrays
 
-        #Total census of Ventilator patients
-        if pd.notna(row['Number of Ventilators In Use']):
-          daily_hospital_census['total_vent_census'][facility][index_val.days] = row['Number of Ventilators In Use']
-          
-        #Total number of ventilators
-        if pd.notna(row['Number of Ventilators in Hospital']):
-          daily_hospital_census['total_vent_capacity'][facility][index_val.days] = row['Number of Ventilators in Hospital']
-          
-        #Total surge capacity
-        if pd.notna(row['Number of Additional Surge Beds Being Planned']):
-          daily_hospital_census['total_surge'][facility][index_val.days] = row['Number of Additional Surge Beds Being Planned']
-          
-  #clean hospital admission/census data    
-  for facility in facility_list:  
-    index_list = []
-    if facility == 'Western Wake Medical Center' and admissions_date[facility][yy] < datetime.strptime('07-24-2020', '%m-%d-%Y'):
-      dontuse = 1
-    else: 
-      for yy in range(0, len(daily_hospital_census['admissions'][facility])):
-        if admissions_date[facility][yy] >= start_value:
-        
-          ####For census/capacity observations, we need to smooth out bumpy data (i.e, census vals that go from 20 -> 0 -> 20
-          for admission_type in admission_types:
-            if admission_type != 'admissions':
-              #look for large reductions in capacity
-              if daily_hospital_census[admission_type][facility][yy] < 0.5*daily_hospital_census[admission_type][facility][yy-1]:
-                #if a large rebound occurs, 'smooth out' the drop (i.e., assume data recording error)
-                if yy < len(daily_hospital_census[admission_type][facility]) - 14:
-                  #look for a rebound during the next two weeks
-                  for xxx in range(1, 14):
-                    if daily_hospital_census[admission_type][facility][yy+xxx] > 0.8*daily_hospital_census[admission_type][facility][yy-1]:
-                      daily_hospital_census[admission_type][facility][yy] = daily_hospital_census[admission_type][facility][yy - 1] 
-                else:
-                  #if less than two weeks of data remain, assume its an error
-                  daily_hospital_census[admission_type][facility][yy] = daily_hospital_census[admission_type][facility][yy - 1] 
-
-    ##scale census/capacity data to final estimate of hospital capacity
-    census_types = ['total_census', 'total_icu_census']
-    capacity_types = ['total_capacity', 'total_icu_capacity']
-    for census_name, capacity_name in zip(census_types, capacity_types):
-      for yy in range(0, len(admissions_date[facility])):
-        if admissions_date[facility][yy] >= start_value:
-          if daily_hospital_census[capacity_name][facility][yy] > 0.0:
-            daily_hospital_census[census_name][facility][yy] = daily_hospital_census[census_name][facility][yy] * daily_hospital_census[capacity_name][facility][-1]/daily_hospital_census[capacity_name][facility][yy]
-            daily_hospital_census[capacity_name][facility][yy] = daily_hospital_census[capacity_name][facility][-1] * 1.0
-            
-    for yy in range(0, len(admissions_date[facility])):
-      if admissions_date[facility][yy] >= start_value:
-        if daily_hospital_census['total_surge'][facility][yy] > 0.0:
-          daily_hospital_census['total_surge'][facility][yy] = daily_hospital_census['total_surge'][facility][-1] * 1.0
+def unpack_artifacts(packed_arrays):
+  #this function rebuilds the nested dictionary flattened by pack_artifacts
+  artifact_dict = {}
+  for packed_name in packed_arrays.files:
+    name_list = packed_name.split('/')
+    current_dict = artifact_dict
+    for artifact_key in name_list[:-1]:
+      if artifact_key not in current_dict:
+        current_dict[artifact_key] = {}
+      current_dict = current_dict[artifact_key]
+    if name_list[-1] == '@keys':
+      for artifact_key, artifact_value in zip(packed_arrays[packed_name], packed_arrays[packed_name[:-4] + 'values']):
+        current_dict[str(artifact_key)] = artifact_value
+    elif name_list[-1] == '@series':
+      series_name = '/'.join(name_list[:-1])
+      parent_dict = artifact_dict
+      for artifact_key in name_list[:-2]:
+        parent_dict = parent_dict[artifact_key]
+      parent_dict[name_list[-2]] = pd.Series(packed_arrays[packed_name], index = packed_arrays[series_name + '/@index'])
+    elif name_list[-1] == '@list':
+      parent_dict = artifact_dict
+      for artifact_key in name_list[:-2]:
+        parent_dict = parent_dict[artifact_key]
+      parent_dict[name_list[-2]] = packed_arrays[packed_name].tolist()
+    elif name_list[-1] not in ['@values', '@index', '@empty']:
+      current_dict[name_list[-1]] = packed_arrays[packed_name]
+  return artifact_dict
 
-  ##aggregate hospitals to regions
+def write_artifact_cache(artifact_dict, cache_folder, cache_key):
+  #this function saves a nested dictionary of calibration results as a single binary .npz file
+  #the file is written under a temporary name and then moved, and the manifest is written last, so a partially written cache is never read
+  if not os.path.isdir(cache_folder):
+    os.makedirs(cache_folder)
+  with open(cache_folder + '/artifacts.tmp.npz', 'wb') as artifact_file:
+    np.savez(artifact_file, **pack_artifacts(artifact_dict, {}))
+  os.replace(cache_folder + '/artifacts.tmp.npz', cache_folder + '/artifacts.npz')
+  with open(cache_folder + '/manifest.json', 'w') as manifest_file:
+    json.dump({'key': cache_key}, manifest_file)
+
+def read_artifact_cache(cache_folder, cache_key):
+  #this function reads the calibration results written by write_artifact_cache
+  #returns None if there is no cache or if it was made from different inputs
+  manifest_name = cache_folder + '/manifest.json'
+  if not os.path.isfile(manifest_name):
+    return None
+  with open(manifest_name, 'r') as manifest_file:
+    cache_manifest = json.load(manifest_file)
+  if cache_manifest['key'] != cache_key or not os.path.isfile(cache_folder + '/artifacts.npz'):
+    return None
+  with np.load(cache_folder + '/artifacts.npz', allow_pickle = False) as packed_arrays:
+    return unpack_artifacts(packed_arrays)
+
+def find_state_hospital_files(data_folder = 'state_hospital_data'):
+  #find all of the monthly state hospital data files (UNC_Data_Request_*.csv)
+  return sorted(glob.glob(data_folder + '/UNC_Data_Request_*.csv'))
+
+def make_state_hospital_schema():
+  #columns read from the state hospital files - short name : [column name, data type]
+  #all other columns are skipped
+  hospital_schema = {}
+  hospital_schema['facility'] = ['hospital', 'category']
+  hospital_schema['date'] = ['Date', 'str']
+  #new covid admissions use confirmed covid cases (suspected cases are not added)
+  hospital_schema['admissions'] = ['Number of new patients admitted to an inpatient bed who had confirmed COVID-19 at the time of admission in the past 24 hours', 'float32']
+  hospital_schema['covid_census'] = ['Number of COVID-19 Positive Patients In Hospital', 'float32']
+  hospital_schema['total_census'] = ['Inpatient Census (all bed types)', 'float32']
+  hospital_schema['total_capacity'] = ['Staffed Inpatient Capacity (all bed types)', 'float32']
+  hospital_schema['covid_icu_census'] = ['Number of COVID-19 Positive Adults in ICU', 'float32']
+  hospital_schema['total_icu_census'] = ['Adult ICU Census', 'float32']
+  hospital_schema['total_icu_capacity'] = ['Adult ICU Staffed Bed Capacity', 'float32']
+  hospital_schema['total_vent_census'] = ['Number of Ventilators In Use', 'float32']
+  hospital_schema['total_vent_capacity'] = ['Number of Ventilators in Hospital', 'float32']
+  hospital_schema['total_surge'] = ['Number of Additional Surge Beds Being Planned', 'float32']
+  return hospital_schema
+
+def make_census_metric_index():
+  #index of each census metric (every column in the state hospital schema except the facility and date)
+  metric_index = {}
+  for alias in make_state_hospital_schema():
+    if alias != 'facility' and alias != 'date':
+      metric_index[alias] = len(metric_index)
+  return metric_index
+
+def read_state_hospital_file(file_name, chunk_size = 5000, alias_list = None):
+  #this function reads a single monthly state hospital file in chunks of chunk_size rows
+  #only the columns in the state hospital schema are read (or only the schema columns named in alias_list), and they are renamed to their short names
+  #yields one dataframe per chunk
+  hospital_schema = make_state_hospital_schema()
+  if alias_list is not None:
+    hospital_schema = {alias: hospital_schema[alias] for alias in alias_list}
+  #match schema columns to the file header
+  #(the first column name of some files starts with a byte order mark, and later files name the facility column 'hospital_name')
+  header_names = pd.read_csv(file_name, encoding = 'latin', nrows = 0).columns
+  schema_columns = {}
+  for alias, (column_name, column_type) in hospital_schema.items():
+    schema_columns[column_name] = alias
+  if 'facility' in hospital_schema:
+    schema_columns['hospital_name'] = 'facility'
+  column_aliases = {}
+  column_types = {}
+  for header_name in header_names:
+    column_name = header_name.replace('\xef\xbb\xbf', '').strip()
+    if column_name in schema_columns and schema_columns[column_name] not in column_aliases.values():
+      column_aliases[header_name] = schema_columns[column_name]
+      column_types[header_name] = hospital_schema[schema_columns[column_name]][1]
+
+  for hospital_chunk in pd.read_csv(file_name, encoding = 'latin', usecols = list(column_aliases), dtype = column_types, chunksize = chunk_size):
+    hospital_chunk = hospital_chunk.rename(columns = column_aliases)
+    #set date string to datetime
+    hospital_chunk['date'] = pd.to_datetime(hospital_chunk['date'], format = '%m/%d/%Y')
+    yield hospital_chunk
+
+def expand_census_cube(census_cube, facility_index, cube_start_date, new_facilities, new_start, new_end, fill_value = 0.0):
+  #this function expands a (facility, day, metric) census array to include new facilities and the days from new_start to new_end
+  #new facilities are added to the end of the facility index, and new cells are set to fill_value
+  #returns the expanded census array, facility index dictionary, and the date of day 0
+  facility_index = dict(facility_index)
+  for facility in new_facilities:
+    if facility not in facility_index:
+      facility_index[facility] = len(facility_index)
+  if cube_start_date is None:
+    cube_start = np.datetime64(new_start, 'D')
+    cube_end = np.datetime64(new_end, 'D')
+  else:
+    cube_start = min(np.datetime64(cube_start_date, 'D'), np.datetime64(new_start, 'D'))
+    cube_end = max(np.datetime64(cube_start_date, 'D') + census_cube.shape[1] - 1, np.datetime64(new_end, 'D'))
+  num_days = int((cube_end - cube_start).astype(int)) + 1
+  if census_cube.shape[0] == len(facility_index) and census_cube.shape[1] == num_days:
+    return census_cube, facility_index, cube_start_date
+  expanded_cube = np.full((len(facility_index), num_days, census_cube.shape[2]), fill_value)
+  if cube_start_date is not None:
+    day_shift = int((np.datetime64(cube_start_date, 'D') - cube_start).astype(int))
+    expanded_cube[:census_cube.shape[0], day_shift:(day_shift + census_cube.shape[1]), :] = census_cube
+  return expanded_cube, facility_index, pd.Timestamp(cube_start).to_pydatetime()
+
+def upsert_census_cube(census_cube, facility_index, cube_start_date, hospital_admissions, fill_value = 0.0):
+  #this function writes the values reported in a table of state hospital data into a (facility, day, metric) census array
+  #the array is expanded to include any new facilities or days in the table, and reported values overwrite the values already in the array
+  #returns the updated census array, facility index dictionary, and the date of day 0
+  metric_index = make_census_metric_index()
+  num_metrics = len(metric_index)
+  facility_codes, facility_names = pd.factorize(hospital_admissions['facility'], sort = True)
+  report_dates = hospital_admissions['date'].to_numpy().astype('datetime64[D]')
+  if len(report_dates) == 0:
+    return census_cube, facility_index, cube_start_date
+  census_cube, facility_index, cube_start_date = expand_census_cube(census_cube, facility_index, cube_start_date, facility_names, report_dates.min(), report_dates.max(), fill_value)
+  num_days = census_cube.shape[1]
+  facility_map = np.zeros(len(facility_names), dtype = int)
+  for facility_num, facility in enumerate(facility_names):
+    facility_map[facility_num] = facility_index[facility]
+
+  #integer facility and day index of every row
+  valid_rows = facility_codes >= 0
+  facility_codes = np.where(valid_rows, facility_map[facility_codes], -1)
+  day_codes = (report_dates - np.datetime64(cube_start_date, 'D')).astype(int)
+
+  #sort rows by facility and day - when a facility reports the same day more than once,
+  #the last reported (non-missing) value is used
+  row_order = np.lexsort((day_codes, facility_codes))
+  row_order = row_order[valid_rows[row_order]]
+  cell_codes = facility_codes[row_order] * num_days + day_codes[row_order]
+  flat_cube = census_cube.reshape(-1, num_metrics)
+
+  #Duke University Hospital icu census data from 10/4/2020 - 11/19/2020 is replaced by icu capacity
+  #whenever the census is reported, even if the capacity itself is missing
+  duke_icu_rows = (hospital_admissions['facility'].to_numpy() == 'Duke University Hospital') & (report_dates >= np.datetime64('2020-10-04')) & (report_dates <= np.datetime64('2020-11-19'))
+  for metric, metric_num in metric_index.items():
+    if metric in hospital_admissions:
+      metric_values = hospital_admissions[metric].to_numpy(dtype = float)
+    else:
+      metric_values = np.full(len(hospital_admissions), np.nan)
+    has_value = ~np.isnan(metric_values)
+    if metric == 'total_icu_census' and 'total_icu_capacity' in hospital_admissions:
+      icu_capacity = hospital_admissions['total_icu_capacity'].to_numpy(dtype = float)
+      metric_values = np.where(duke_icu_rows, icu_capacity, metric_values)
+    metric_rows = row_order[has_value[row_order]]
+    metric_cells = cell_codes[has_value[row_order]]
+    #only keep the last row reported for each facility/day
+    last_in_cell = np.diff(metric_cells, append = -1) != 0
+    flat_cube[metric_cells[last_in_cell], metric_num] = metric_values[metric_rows[last_in_cell]]
+
+  return census_cube, facility_index, cube_start_date
+
+def make_file_census_cube(file_name):
+  #this function pivots a single monthly file into a census array, one chunk at a time
+  #cells that are not reported in the file are nan
+  #returns the census array, facility index dictionary, date of day 0, and the last date in the file
+  census_cube = np.zeros((0, 0, len(make_census_metric_index())))
+  facility_index = {}
+  cube_start_date = None
+  for hospital_chunk in read_state_hospital_file(file_name):
+    census_cube, facility_index, cube_start_date = upsert_census_cube(census_cube, facility_index, cube_start_date, hospital_chunk, fill_value = np.nan)
+  last_date = (cube_start_date + timedelta(census_cube.shape[1] - 1)).strftime('%Y-%m-%d')
+  return census_cube, facility_index, cube_start_date, last_date
+
+def find_state_hospital_last_date(file_name):
+  #this function finds the last date reported in a single monthly file, reading only the date column one chunk at a time
+  #returns the date as a string in the same format as the last date from make_file_census_cube
+  last_date = None
+  for hospital_chunk in read_state_hospital_file(file_name, alias_list = ['date']):
+    if len(hospital_chunk) > 0 and (last_date is None or hospital_chunk['date'].max() > last_date):
+      last_date = hospital_chunk['date'].max()
+  return last_date.strftime('%Y-%m-%d')
+
+def merge_census_cube(census_cube, facility_index, cube_start_date, file_cube, file_facility_index, file_start_date):
+  #this function overwrites the census array with every value reported in a single file's census array (from make_file_census_cube)
+  #returns the updated census array, facility index dictionary, and the date of day 0
+  file_end_date = file_start_date + timedelta(file_cube.shape[1] - 1)
+  census_cube, facility_index, cube_start_date = expand_census_cube(census_cube, facility_index, cube_start_date, list(file_facility_index), file_start_date, file_end_date)
+  census_cube = np.array(census_cube)
+  day_shift = (file_start_date - cube_start_date).days
+  for facility, file_facility_num in file_facility_index.items():
+    facility_values = census_cube[facility_index[facility], day_shift:(day_shift + file_cube.shape[1]), :]
+    reported_values = ~np.isnan(file_cube[file_facility_num])
+    facility_values[reported_values] = file_cube[file_facility_num][reported_values]
+  return census_cube, facility_index, cube_start_date
+
+def update_census_store(data_folder = 'state_hospital_data', store_folder = 'state_hospital_cache/census_store'):
+  #this function keeps an append-only store of the (facility, day, metric) census array
+  #new monthly files found in data_folder are read and their values are upserted into the stored array, files that were already stored are not read again
+  #files are stored in order of the last date they report, so values from newer files overwrite older ones
+  #if a stored file changes or disappears, or a new file reports older data than the stored files, the store is rebuilt from all files
+  #returns the census array, dictionaries with the facility and metric index of each name, and the date of day 0
+  metric_index = make_census_metric_index()
+  file_stats = {}
+  for file_name in find_state_hospital_files(data_folder):
+    file_info = os.stat(file_name)
+    file_stats[os.path.basename(file_name)] = [file_info.st_size, file_info.st_mtime_ns]
+
+  #load the stored array and the list of files it was made from
+  manifest_name = store_folder + '/manifest.json'
+  stored_files = []
+  if os.path.isfile(manifest_name):
+    with open(manifest_name, 'r') as manifest_file:
+      store_manifest = json.load(manifest_file)
+    if store_manifest['metrics'] == list(metric_index):
+      stored_files = store_manifest['files']
+  for file_name, file_size, file_mtime, last_date in stored_files:
+    if file_stats.get(file_name) != [file_size, file_mtime]:
+      stored_files = []
+      break
+  if len(stored_files) > 0:
+    census_cube = np.load(store_folder + '/census_cube.npy', mmap_mode = 'r')
+    facility_index = {}
+    for facility_num, facility in enumerate(store_manifest['facilities']):
+      facility_index[facility] = facility_num
+    cube_start_date = datetime.strptime(store_manifest['start_date'], '%Y-%m-%d')
+  else:
+    census_cube = np.zeros((0, 0, len(metric_index)))
+    facility_index = {}
+    cube_start_date = None
+
+  #find the new files and the last date each one reports (files are only parsed when they are merged, one at a time, so memory use does not grow with the number of files)
+  stored_names = set()
+  for stored_file in stored_files:
+    stored_names.add(stored_file[0])
+  new_files = []
+  for file_name in file_stats:
+    if file_name not in stored_names:
+      new_files.append([find_state_hospital_last_date(data_folder + '/' + file_name), file_name])
+  if len(new_files) == 0:
+    return census_cube, facility_index, metric_index, cube_start_date
+  new_files.sort()
+  if len(stored_files) > 0 and new_files[0][0] < stored_files[-1][3]:
+    #new data is older than the stored data, so start over with all files (the last date of each stored file is in the manifest)
+    for file_name, file_size, file_mtime, last_date in stored_files:
+      new_files.append([last_date, file_name])
+    new_files.sort()
+    stored_files = []
+    census_cube = np.zeros((0, 0, len(metric_index)))
+    facility_index = {}
+    cube_start_date = None
+
+  #upsert the new files into the census array
+  for last_date, file_name in new_files:
+    file_cube, file_facility_index, file_start_date, last_date = make_file_census_cube(data_folder + '/' + file_name)
+    census_cube, facility_index, cube_start_date = merge_census_cube(census_cube, facility_index, cube_start_date, file_cube, file_facility_index, file_start_date)
+    del file_cube
+    stored_files.append([file_name, file_stats[file_name][0], file_stats[file_name][1], last_date])
+
+  #save the array first and the manifest last, so a partially written store is never read
+  if not os.path.isdir(store_folder):
+    os.makedirs(store_folder)
+  np.save(store_folder + '/census_cube_new.npy', census_cube)
+  os.replace(store_folder + '/census_cube_new.npy', store_folder + '/census_cube.npy')
+  with open(manifest_name, 'w') as manifest_file:
+    json.dump({'files': stored_files, 'facilities': list(facility_index), 'metrics': list(metric_index), 'start_date': cube_start_date.strftime('%Y-%m-%d')}, manifest_file)
+
+  return census_cube, facility_index, metric_index, cube_start_date
+
+def clean_census_cube(census_cube, metric_index, cube_start_date, start_value):
+  #this function cleans the census array for all facilities and metrics at once
+  #returns the cleaned census array and a boolean array that is True for every value that was changed
+  cleaned_cube = census_cube.copy()
+  num_facilities, num_days, num_metrics = census_cube.shape
+  #only days on/after start_value are cleaned
+  first_day = max((start_value - cube_start_date).days, 0)
+
+  ####For census/capacity observations, we need to smooth out bumpy data (i.e, census vals that go from 20 -> 0 -> 20
+  census_metrics = []
+  for admission_type in metric_index:
+    if admission_type != 'admissions':
+      census_metrics.append(metric_index[admission_type])
+  census_values = cleaned_cube[:, :, census_metrics]
+  #largest value in the 13 days after each day - values after the current day have not been cleaned yet, so this can be found before cleaning starts
+  rebound_window = 13
+  padded_values = np.concatenate([census_values[:, 1:, :], np.full((num_facilities, rebound_window, len(census_metrics)), np.nan)], axis = 1)
+  rebound_max = np.fmax.reduce(sliding_window_view(padded_values, rebound_window, axis = 1), axis = -1)
+  #each day is compared to the (cleaned) value from the day before, so days are cleaned in order
+  #(the first day is compared to the last day of the record)
+  previous_values = census_values[:, first_day - 1, :].copy()
+  for yy in range(first_day, num_days):
+    #look for large reductions in capacity
+    is_drop = census_values[:, yy, :] < 0.5 * previous_values
+    if yy < num_days - 14:
+      #if a large rebound occurs during the next two weeks, 'smooth out' the drop (i.e., assume data recording error)
+      is_drop = is_drop & (rebound_max[:, yy, :] > 0.8 * previous_values)
+    #if less than two weeks of data remain, assume its an error
+    census_values[:, yy, :] = np.where(is_drop, previous_values, census_values[:, yy, :])
+    previous_values = census_values[:, yy, :]
+  cleaned_cube[:, :, census_metrics] = census_values
+
+  ##scale census/capacity data to final estimate of hospital capacity
+  census_types = ['total_census', 'total_icu_census']
+  capacity_types = ['total_capacity', 'total_icu_capacity']
+  for census_name, capacity_name in zip(census_types, capacity_types):
+    census = cleaned_cube[:, :, metric_index[census_name]]
+    capacity = cleaned_cube[:, :, metric_index[capacity_name]]
+    final_capacity = np.broadcast_to(capacity[:, -1:], capacity.shape).copy()
+    rescale_cells = capacity > 0.0
+    rescale_cells[:, :first_day] = False
+    census[rescale_cells] = census[rescale_cells] * final_capacity[rescale_cells] / capacity[rescale_cells]
+    capacity[rescale_cells] = final_capacity[rescale_cells]
+  surge = cleaned_cube[:, :, metric_index['total_surge']]
+  final_surge = np.broadcast_to(surge[:, -1:], surge.shape).copy()
+  rescale_cells = surge > 0.0
+  rescale_cells[:, :first_day] = False
+  surge[rescale_cells] = final_surge[rescale_cells]
+
+  cleaned_cells = (cleaned_cube != census_cube) & ~(np.isnan(cleaned_cube) & np.isnan(census_cube))
+  return cleaned_cube, cleaned_cells
+
+def make_region_membership(region_facilities, facility_index):
+  #this function makes a sparse (region x facility) matrix with a 1 for each facility in a region
+  #region_facilities is a dictionary with a list of facility names for each region
+  region_index = {}
+  membership_indices = []
+  membership_indptr = [0]
+  for region_num, region_name in enumerate(region_facilities):
+    region_index[region_name] = region_num
+    for facility in region_facilities[region_name]:
+      #facilities that are not in the state hospital data are skipped
+      if facility in facility_index:
+        membership_indices.append(facility_index[facility])
+    membership_indptr.append(len(membership_indices))
+  membership = sparse.csr_matrix((np.ones(len(membership_indices)), membership_indices, membership_indptr), shape = (len(region_facilities), len(facility_index)))
+  return membership, region_index
+
+def aggregate_regions(census_cube, facility_index, metric_index, cube_start_date, region_facilities, start_value, end_value):
+  #this function aggregates the facility census array to any number of regions with a single matrix multiplication
+  #returns a dictionary with the regional census timeseries (start_value - end_value) of each metric, for each region
+  membership, region_index = make_region_membership(region_facilities, facility_index)
+  num_facilities, num_days, num_metrics = census_cube.shape
+  regional_cube = (membership @ census_cube.reshape(num_facilities, num_days * num_metrics)).reshape(len(region_index), num_days, num_metrics)
+  #surge capacity is the number of additional beds, so add it to the staffed capacity
+  regional_cube[:, :, metric_index['total_surge']] += regional_cube[:, :, metric_index['total_capacity']]
+
+  #regional timeseries start at start_value
+  first_day = (start_value - cube_start_date).days
+  last_day = (end_value - cube_start_date).days
+  cube_days = slice(max(first_day, 0), min(last_day + 1, num_days))
+  regional_days = slice(cube_days.start - first_day, cube_days.stop - first_day)
   regional_census = {}
-  admission_types = ['admissions', 'covid_census', 'total_census', 'total_capacity', 'covid_icu_census', 'total_icu_census', 'total_icu_capacity', 'total_vent_census', 'total_vent_capacity', 'total_surge']
-  for admission_type in admission_types:
-    regional_census[admission_type] = np.zeros(total_length.days + 1)
-
-  #loop through all hospitals and collect aggregated regional data
-  for facility in facility_list:  
-    index_list = []
-    for yy in range(0, len(admissions_date[facility])):
-      if admissions_date[facility][yy] >= start_value and admissions_date[facility][yy] <= end_value:
-        index_day = admissions_date[facility][yy] - start_value
-        for admission_type in admission_types:
-          if admission_type == 'total_surge':
-            regional_census[admission_type][index_day.days] += daily_hospital_census[admission_type][facility][yy] + daily_hospital_census['total_capacity'][facility][yy]
-          else:
-            regional_census[admission_type][index_day.days] += daily_hospital_census[admission_type][facility][yy]
-        index_list.append(admissions_date[facility][yy])
-  
-    
+  for region_name, region_num in region_index.items():
+    regional_census[region_name] = {}
+    for admission_type, metric_num in metric_index.items():
+      regional_census[region_name][admission_type] = np.zeros(num_days)
+      regional_census[region_name][admission_type][regional_days] = regional_cube[region_num, cube_days, metric_num]
+
+  return regional_census
+
+def summarize_cleaned_cells(cleaned_cells, facility_index, metric_index, region_facilities):
+  #this function counts the number of days with a value changed by clean_census_cube, for each metric of each facility in region_facilities
+  #returns a dataframe with a row for each (region, facility) and a column for each metric
+  report_rows = []
+  report_index = []
+  for region_name in region_facilities:
+    for facility in region_facilities[region_name]:
+      #facilities that are not in the state hospital data are skipped
+      if facility in facility_index:
+        report_rows.append(np.sum(cleaned_cells[facility_index[facility]], axis = 0))
+        report_index.append((region_name, facility))
+  cleaning_report = pd.DataFrame(np.zeros((len(report_rows), len(metric_index)), dtype = int), index = pd.MultiIndex.from_tuples(report_index, names = ['region', 'facility']), columns = list(metric_index))
+  if len(report_rows) > 0:
+    cleaning_report.loc[:, :] = np.vstack(report_rows)
+  return cleaning_report
+
+def load_regional_census(region_facilities, start_value, end_value):
+  #this function loads and cleans the statewide hospital data once, and aggregates it to every region in region_facilities
+  #returns dictionaries with aggregated regional timeseries for each region, and a report of the number of values changed by cleaning
+  #for each metric of each facility in the regions (see summarize_cleaned_cells)
+  #load statewide hospital admissions data (monthly files), only new files are read
+  census_cube, facility_index, metric_index, cube_start_date = update_census_store()
+  #clean hospital admission/census data
+  census_cube, cleaned_cells = clean_census_cube(census_cube, metric_index, cube_start_date, start_value)
+  cleaning_report = summarize_cleaned_cells(cleaned_cells, facility_index, metric_index, region_facilities)
+
+  ##aggregate hospitals to regions
+  return aggregate_regions(census_cube, facility_index, metric_index, cube_start_date, region_facilities, start_value, end_value), cleaning_report
+
+def write_regional_timeseries(regional_census, regional_name):
+  #save regional icu census/capacity timeseries
+  if not os.path.isdir('covid_timeseries_agg'):
+    os.mkdir('covid_timeseries_agg')
+  regional_icu_census = pd.DataFrame(regional_census['total_icu_census'])
+  regional_icu_census.to_csv('covid_timeseries_agg/regional_icu_timeseries_' + regional_name + '.csv')
+  regional_icu_cov_census = pd.DataFrame(regional_census['covid_icu_census'])
+  regional_icu_cov_census.to_csv('covid_timeseries_agg/regional_cov_icu_timeseries_' + regional_name + '.csv')
+  regional_icu_capacity = pd.DataFrame(regional_census['total_icu_capacity'])
+  regional_icu_capacity.to_csv('covid_timeseries_agg/regional_icu_capacity_timeseries_' + regional_name + '.csv')
+
+def write_cleaning_report(cleaning_report, report_name):
+  #save the number of values changed by cleaning for each facility/metric (from load_regional_census) with the regional timeseries
+  if not os.path.isdir('covid_timeseries_agg'):
+    os.mkdir('covid_timeseries_agg')
+  cleaning_report.to_csv('covid_timeseries_agg/cleaned_census_cells_' + report_name + '.csv')
+
+def load_facilities(facility_list, start_value, end_value, regional_name = 'none', show_plot = False):
+  #aggregate a single group of hospitals to a region
+  all_regional_census, cleaning_report = load_regional_census({regional_name: facility_list}, start_value, end_value)
+  regional_census = all_regional_census[regional_name]
+
   if regional_name == 'none':
     pass
   else:
-    if not os.path.isdir('covid_timeseries_agg'):
-      os.mkdir('covid_timeseries_agg')
-    regional_icu_census = pd.DataFrame(regional_census['total_icu_census'])
-    regional_icu_census.to_csv('covid_timeseries_agg/regional_icu_timeseries_' + regional_name + '.csv')
-    regional_icu_cov_census = pd.DataFrame(regional_census['covid_icu_census'])
-    regional_icu_cov_census.to_csv('covid_timeseries_agg/regional_cov_icu_timeseries_' + regional_name + '.csv')
-    regional_icu_capacity = pd.DataFrame(regional_census['total_icu_capacity'])
-    regional_icu_capacity.to_csv('covid_timeseries_agg/regional_icu_capacity_timeseries_' + regional_name + '.csv')
+    write_regional_timeseries(regional_census, regional_name)
+    write_cleaning_report(cleaning_report, regional_name)
 
   return regional_census
 
-def calibrate_msdrg_changes(inpatient_data, procedure_type_list, admission_type_list, mdc_list, period_range, start_val, capacity_ratio):
+def calibrate_msdrg_changes(inpatient_data, procedure_type_list, admission_type_list, mdc_list, period_range, start_val, capacity_ratio, num_workers = 1, fit_method = 'curve_fit'):
 
-  #get dates for inpatient data
-  inpatient_data['Dates'] = make_date_list(inpatient_data, 2018, 1, 1)
-  inpatient_data = inpatient_data.set_index('Dates')
+  #get daily (category x [msdrg, admissions] x day) arrays and dates for inpatient data
+  inpatient_values, category_index = make_inpatient_arrays(inpatient_data, procedure_type_list, admission_type_list, mdc_list)
+  inpatient_dates = make_inpatient_dates(inpatient_values.shape[2], 2018, 1, 1)
   
   #find pre-covid baseline (2018 & 2019)
   start_baseline_date = datetime.strptime('01/01/2018', '%d/%m/%Y')
   end_baseline_date = datetime.strptime('01/01/2020', '%d/%m/%Y')
   start_covid_date = datetime.strptime('10/03/2020', '%d/%m/%Y')
   #get 7-day MA of admission/msdrg in each admission category across entire timeseries
-  inpatient_data_ma = get_inpatient_moving_averages(inpatient_data, procedure_type_list, admission_type_list, mdc_list, capacity_ratio)
+  inpatient_ma = get_inpatient_moving_averages(inpatient_values, capacity_ratio)
   #get 7-day MA of admission/msdrg for each admission category (seasonal averages)
-  daily_admission, daily_msdrg = calculate_baseline_seasonal_patterns(inpatient_data_ma, procedure_type_list, admission_type_list, mdc_list, start_baseline_date, end_baseline_date)
+  daily_admission, daily_msdrg = calculate_baseline_seasonal_patterns(inpatient_ma, category_index, inpatient_dates, admission_type_list, mdc_list, start_baseline_date, end_baseline_date)
   
   #get the ratio of total admissions & msdrg in Jan/Feb 2020 to the average from the same period in 2018-19 for each admission type  
-  daily_admission_ratio, daily_msdrg_ratio = calculate_pre_covid_trends(inpatient_data_ma, daily_admission, daily_msdrg, mdc_list, admission_type_list, end_baseline_date, start_covid_date)
+  daily_admission_ratio, daily_msdrg_ratio = calculate_pre_covid_trends(inpatient_ma, category_index, inpatient_dates, daily_admission, daily_msdrg, mdc_list, admission_type_list, end_baseline_date, start_covid_date)
   
-  leap_year_date = datetime.strptime('29/02/2020', '%d/%m/%Y')
   start_validation_date = datetime.strptime('01/03/2020', '%d/%m/%Y')
   end_validation_date = datetime.strptime('01/02/2021', '%d/%m/%Y')
   #get total admissions/msdrg during 2020/21 as a pct of the same day of the year in 2018/2019
-  tot_admissions, tot_msdrg = calculate_covid_changes(inpatient_data_ma, daily_admission, daily_msdrg, procedure_type_list, admission_type_list, mdc_list, end_baseline_date, start_validation_date, end_validation_date, leap_year_date)
+  tot_admissions, tot_msdrg = calculate_covid_changes(inpatient_values, inpatient_ma, category_index, inpatient_dates, daily_admission, daily_msdrg, procedure_type_list, admission_type_list, mdc_list, end_baseline_date, start_validation_date, end_validation_date)
   #parameterize a logit function to fit the observed changes in admissions/msdrg per admit for 3 different periods during the covid period, 
       
-  function_parameters, msdrg_per_admit = calibrate_msdrg_codes(tot_admissions['series'], tot_msdrg['series'], daily_admission, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, admission_type_list, mdc_list, period_range, start_val)
+  parameter_tensor, msdrg_per_admit, fit_report = calibrate_msdrg_codes(tot_admissions['series'], tot_msdrg['series'], daily_admission, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, admission_type_list, mdc_list, period_range, start_val, num_workers = num_workers, fit_method = fit_method)
   
-  return daily_admission, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, tot_admissions, tot_msdrg, msdrg_per_admit, function_parameters
-
-def make_date_list(inpatient_data, start_year, start_month, start_date):
-  dates_list = []
-  days_in_month = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-  days_in_month2 = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-  current_month = start_month
-  current_date = start_date
-  current_year = start_year
+  return daily_admission, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, tot_admissions, tot_msdrg, msdrg_per_admit, parameter_tensor, fit_report
+
+def make_inpatient_arrays(inpatient_data, procedure_type_list, admission_type_list, mdc_list):
+  #this function copies the daily inpatient data into a single (category x [msdrg, admissions] x day) array
+  #categories are the 4 procedure/admission groups, the MDC groups (EI/IP), and covid-like illnesses
+  #[:, 0, :] is total msdrg (column 'category'), [:, 1, :] is total admissions (column 'ADMIT_category')
+  category_index = {}
+  for procedure_type in procedure_type_list:
+    for admission_type in admission_type_list:
+      category_index[procedure_type + '_' + admission_type] = len(category_index)
+  for mdc_num in mdc_list:
+    for admission_type in admission_type_list:
+      category_index[admission_type + '_' + mdc_num] = len(category_index)
+  category_index['COVID'] = len(category_index)
+  column_list = []
+  for category in category_index:
+    column_list.append(category)
+    column_list.append('ADMIT_' + category)
+  inpatient_values = np.ascontiguousarray(inpatient_data[column_list].to_numpy(dtype = float).T).reshape(len(category_index), 2, len(inpatient_data))
+  return inpatient_values, category_index
+
+def make_inpatient_dates(num_days, start_year, start_month, start_date):
   #inpatient data is daily starting 1/1/2018
-  #make datestring list
-  for x in range(0, len(inpatient_data['ADMIT'])):
-    date_string = str(current_date).zfill(2)
-    month_string = str(current_month).zfill(2)
-    year_string = str(current_year)
-    datetime_date = datetime.strptime(date_string + '/' + month_string + '/' + year_string, '%d/%m/%Y')
-    dates_list.append(datetime_date)
-    current_date += 1
-    if current_year == 2020:
-      if current_date == days_in_month2[current_month-1] + 1:
-        current_date = 1
-        current_month += 1
-    else:
-      if current_date == days_in_month[current_month-1] + 1:
-        current_date = 1
-        current_month += 1
-    if current_month == 13:
-      current_month = 1
-      current_year += 1
-  return dates_list
-
-def get_inpatient_moving_averages(inpatient_data, procedure_type_list, admission_type_list, mdc_list, capacity_ratio):
+  #returns a dictionary with the date, day-of-year (0-364/365), and the day-of-year on a 365 day calendar of every day in the inpatient data
+  #(for leap years, 2/29 and 3/1 share a day-of-year and later days are shifted back one day)
+  inpatient_dates = {}
+  inpatient_dates['start'] = datetime(start_year, start_month, start_date)
+  inpatient_dates['dates'] = np.datetime64(inpatient_dates['start'], 'D') + np.arange(num_days)
+  year_start = inpatient_dates['dates'].astype('datetime64[Y]')
+  inpatient_dates['day_of_year'] = (inpatient_dates['dates'] - year_start.astype('datetime64[D]')).astype(int)
+  years = year_start.astype(int) + 1970
+  leap_year = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+  inpatient_dates['day_of_year_365'] = inpatient_dates['day_of_year'] - (leap_year & (inpatient_dates['day_of_year'] >= 60))
+  return inpatient_dates
+
+def get_inpatient_moving_averages(inpatient_values, capacity_ratio):
   #this function takes inpatient types and calculates 7-day moving average of admission
-  #get total msdrg/admissions on a rolling weekly average
-  ##use 4-group categories (type_list)
-  for pt in procedure_type_list:
-    for at in admission_type_list:
-      typel = pt + '_' + at
-      inpatient_data[typel + '_MA'] = inpatient_data[typel].rolling(window = 7).mean() * capacity_ratio
-      inpatient_data['ADMIT_' + typel + '_MA'] = inpatient_data['ADMIT_' + typel].rolling(window = 7).mean() * capacity_ratio
-  #make list of all the mdc categories
-  #get rolling average msdrg/admissions for each of the MDC categories (admited via ER and scheduled)
-  for mdc_num in mdc_list:
-    for at in admission_type_list:
-      inpatient_data[at + '_' + mdc_num + '_MA'] = inpatient_data[at + '_' + mdc_num].rolling(window = 7).mean() * capacity_ratio
-      inpatient_data['ADMIT_' + at + '_' + mdc_num + '_MA'] = inpatient_data['ADMIT_' + at + '_' + mdc_num].rolling(window = 7).mean() * capacity_ratio
-  #get 7-day moving average for covid-like illnesses
-  inpatient_data['COVID_MA'] = inpatient_data['COVID'].rolling(window = 7).mean() * capacity_ratio
-  inpatient_data['ADMIT_COVID_MA'] = inpatient_data['ADMIT_COVID'].rolling(window = 7).mean() * capacity_ratio
-
-  return inpatient_data
+  #get total msdrg/admissions on a rolling weekly average for all categories at once
+  #(one rolling window over a day x series frame, so each series is averaged exactly like the old per-column rolling means)
+  num_categories, num_values, num_days = inpatient_values.shape
+  series_by_day = pd.DataFrame(inpatient_values.reshape(num_categories * num_values, num_days).T)
+  inpatient_ma = series_by_day.rolling(window = 7).mean().to_numpy().T.reshape(num_categories, num_values, num_days) * capacity_ratio
+
+  return inpatient_ma
    
-def calculate_baseline_seasonal_patterns(inpatient_data, procedure_type_list, admission_type_list, mdc_list, start_sum_date, end_sum_date):
+def calculate_baseline_seasonal_patterns(inpatient_ma, category_index, inpatient_dates, admission_type_list, mdc_list, start_sum_date, end_sum_date):
   #this function takes timeseries (2018-2019) of inpatient admissions and msdrg scores and calculates baseline seasonal averages
-  days_in_sample = end_sum_date - start_sum_date
-  current_date = start_sum_date + timedelta(0)
-  total_msdrg = 0.0
+  #day-of-year averages are found for all categories at once, grouping each day in the sample by its day-of-year
+  baseline_days = np.arange((start_sum_date - inpatient_dates['start']).days, (end_sum_date - inpatient_dates['start']).days)
+  day_of_year = inpatient_dates['day_of_year'][baseline_days]
+  baseline_years = inpatient_dates['dates'][baseline_days].astype('datetime64[Y]').astype(int) + 1970
+  num_years = len(np.unique(baseline_years))
   
   #initialize array of average values for each day-of-year
-  #for both 4- and 52- category groups
-  daily_msdrg = {}
-  daily_admission = {}
-  for procedure_type in procedure_type_list:
-    for admission_type in admission_type_list:
-      daily_msdrg[procedure_type + '_' + admission_type] = np.zeros(365)
-      daily_admission[procedure_type + '_' + admission_type] = np.zeros(365)
-  for mdc_num in mdc_list:
-    for admission_type in admission_type_list:
-      daily_admission[admission_type + '_' + mdc_num] = np.zeros(365)
-      daily_msdrg[admission_type + '_' + mdc_num] = np.zeros(365)
-  daily_msdrg['COVID'] = np.zeros(365)
-  daily_admission['COVID'] = np.zeros(365)
+  #(category x [msdrg, admissions] x day-of-year), for both 4- and 52- category groups
+  seasonal_values = np.zeros((len(category_index), 2, 365))
   
-  x = 0
   #calculate day-of-year averages for 2018 and 2019
+  #seven-day moving averages can't be calculated for the first six days of the timeseries,
+  #so the first 11 days of the year use the average from the 12th day
   bad_start_data_days = 11
-  while current_date < end_sum_date:
-    x += 1
-    day_of_year = current_date.timetuple().tm_yday - 1
-    #4-category groups
-    for procedure_type in procedure_type_list:
-      for admission_type in admission_type_list:
-       #seven-day moving averages can't be calculated for the first six days of the timeseries
-        if day_of_year == bad_start_data_days:
-          daily_msdrg[procedure_type + '_' + admission_type][day_of_year] += inpatient_data.loc[current_date, procedure_type + '_' + admission_type + '_MA']/2.0
-          daily_admission[procedure_type + '_' + admission_type][day_of_year] += inpatient_data.loc[current_date,'ADMIT_' + procedure_type + '_' + admission_type + '_MA']/2.0
-          for xxx in range(0, bad_start_data_days):
-            daily_msdrg[procedure_type + '_' + admission_type][xxx] += inpatient_data.loc[current_date, procedure_type + '_' + admission_type + '_MA']/2.0
-            daily_admission[procedure_type + '_' + admission_type][xxx] += inpatient_data.loc[current_date,'ADMIT_' + procedure_type + '_' + admission_type + '_MA']/2.0
-        elif day_of_year > bad_start_data_days:
-          daily_msdrg[procedure_type + '_' + admission_type][day_of_year] += inpatient_data.loc[current_date, procedure_type + '_' + admission_type + '_MA']/2.0
-          daily_admission[procedure_type + '_' + admission_type][day_of_year] += inpatient_data.loc[current_date,'ADMIT_' + procedure_type + '_' + admission_type + '_MA']/2.0
-    #52-category groups (only use 2019)
-    for mdc_num in mdc_list:
-      for admission_type in admission_type_list:
-        if mdc_num == '14':
-          if current_date.year == 2019:
-            daily_admission[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date,'ADMIT_' + admission_type + '_' + mdc_num + '_MA']
-            daily_msdrg[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date, admission_type + '_' + mdc_num + '_MA']
-        else:
-          if day_of_year == bad_start_data_days:
-            daily_admission[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date,'ADMIT_' + admission_type + '_' + mdc_num + '_MA']/2.0
-            daily_msdrg[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date, admission_type + '_' + mdc_num + '_MA']/2.0
-            for xxx in range(0, bad_start_data_days):
-              daily_admission[admission_type + '_' + mdc_num][xxx] += inpatient_data.loc[current_date,'ADMIT_' + admission_type + '_' + mdc_num + '_MA']/2.0
-              daily_msdrg[admission_type + '_' + mdc_num][xxx] += inpatient_data.loc[current_date, admission_type + '_' + mdc_num + '_MA']/2.0
-          elif day_of_year > bad_start_data_days:
-            daily_admission[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date,'ADMIT_' + admission_type + '_' + mdc_num + '_MA']/2.0
-            daily_msdrg[admission_type + '_' + mdc_num][day_of_year] += inpatient_data.loc[current_date, admission_type + '_' + mdc_num + '_MA']/2.0
-        
-    #calculate day-of-year averages for covid code baselines
-    if day_of_year == bad_start_data_days:
-      daily_msdrg['COVID'][day_of_year] += inpatient_data.loc[current_date, 'COVID_MA']/2.0
-      daily_admission['COVID'][day_of_year] += inpatient_data.loc[current_date, 'ADMIT_COVID_MA']/2.0
-      for xxx in range(0, bad_start_data_days):
-        daily_msdrg['COVID'][xxx] += inpatient_data.loc[current_date, 'COVID_MA']/2.0
-        daily_admission['COVID'][xxx] += inpatient_data.loc[current_date, 'ADMIT_COVID_MA']/2.0
-    elif day_of_year > bad_start_data_days:
-      daily_msdrg['COVID'][day_of_year] += inpatient_data.loc[current_date, 'COVID_MA']/2.0
-      daily_admission['COVID'][day_of_year] += inpatient_data.loc[current_date, 'ADMIT_COVID_MA']/2.0
-    current_date = start_sum_date + timedelta(x)
+  good_days = day_of_year >= bad_start_data_days
+  np.add.at(seasonal_values, (slice(None), slice(None), day_of_year[good_days]), inpatient_ma[:, :, baseline_days[good_days]] / float(num_years))
+  seasonal_values[:, :, :bad_start_data_days] = seasonal_values[:, :, bad_start_data_days:bad_start_data_days + 1]
+  
+  #52-category groups for MDC 14 (only use 2019, including the first 11 days of the year)
+  if '14' in mdc_list:
+    mdc_14_days = baseline_days[baseline_years == 2019]
+    for admission_type in admission_type_list:
+      category_num = category_index[admission_type + '_14']
+      seasonal_values[category_num] = 0.0
+      np.add.at(seasonal_values[category_num], (slice(None), inpatient_dates['day_of_year'][mdc_14_days]), inpatient_ma[category_num][:, mdc_14_days])
+
+  daily_msdrg = {}
+  daily_admission = {}
+  for category in category_index:
+    daily_msdrg[category] = seasonal_values[category_index[category], 0]
+    daily_admission[category] = seasonal_values[category_index[category], 1]
 
   return daily_admission, daily_msdrg
 
-def calculate_pre_covid_trends(inpatient_data, daily_admission, daily_msdrg, mdc_list, admission_type_list, end_sum_date, start_covid_date):
+def calculate_pre_covid_trends(inpatient_ma, category_index, inpatient_dates, daily_admission, daily_msdrg, mdc_list, admission_type_list, end_sum_date, start_covid_date):
   #during Jan - March 2020, calculate pre-covid 2020 trend compared to 2018-2019 baseline
   #this is a single value for each category group (i.e., what was the pre-covid trend for 2020 admissions?)
-  day_of_year = 0
-  daily_admission_ratio = {}
-  daily_msdrg_ratio = {}
+  category_list = []
   for mdc_num in mdc_list:
     for admission_type in admission_type_list:
-      daily_admission_ratio[admission_type + '_' + mdc_num] = 0.0
-      daily_msdrg_ratio[admission_type + '_' + mdc_num] = 0.0
+      category_list.append(admission_type + '_' + mdc_num)
+  category_rows = [category_index[x] for x in category_list]
     
-  ##sum total admissions/msdrg through March 10th
-  current_date = end_sum_date + timedelta(0)
-  while current_date < start_covid_date:
-    for mdc_num in mdc_list:
-      for admission_type in admission_type_list:
-        daily_msdrg_ratio[admission_type + '_' + mdc_num] += inpatient_data.loc[current_date, admission_type + '_' + mdc_num + '_MA']
-        daily_admission_ratio[admission_type + '_' + mdc_num] += inpatient_data.loc[current_date, 'ADMIT_' + admission_type + '_' + mdc_num + '_MA'] 
-    current_date = end_sum_date + timedelta(day_of_year)
-    day_of_year += 1
+  ##sum total admissions/msdrg through March 10th for all categories at once, (day x category x [msdrg, admissions])
+  #(the first day of 2020 is counted twice, so the sums cover one more day than the number of days before March 10th)
+  num_covid_days = (start_covid_date - end_sum_date).days
+  start_day = (end_sum_date - inpatient_dates['start']).days
+  pre_covid_days = start_day + np.concatenate([[0], np.arange(num_covid_days)])
+  pre_covid_totals = sum_categories(np.moveaxis(inpatient_ma[category_rows][:, :, pre_covid_days], 2, 0))
   #compare total admissions/msdrg in 2020 to the totals in 2018-19 through March 10th
-  for mdc_num in mdc_list:
-    for admission_type in admission_type_list:
-      daily_msdrg_ratio[admission_type + '_' + mdc_num] = daily_msdrg_ratio[admission_type + '_' + mdc_num] / np.sum(daily_msdrg[admission_type + '_' + mdc_num][:day_of_year])
-      daily_admission_ratio[admission_type + '_' + mdc_num] = daily_admission_ratio[admission_type + '_' + mdc_num] / np.sum(daily_admission[admission_type + '_' + mdc_num][:day_of_year])
+  baseline_msdrg_totals = np.sum(np.array([daily_msdrg[x] for x in category_list])[:, :len(pre_covid_days)], axis = 1)
+  baseline_admission_totals = np.sum(np.array([daily_admission[x] for x in category_list])[:, :len(pre_covid_days)], axis = 1)
+  msdrg_ratios = pre_covid_totals[:, 0] / baseline_msdrg_totals
+  admission_ratios = pre_covid_totals[:, 1] / baseline_admission_totals
+  daily_admission_ratio = {}
+  daily_msdrg_ratio = {}
+  for category_num, category in enumerate(category_list):
+    daily_msdrg_ratio[category] = msdrg_ratios[category_num]
+    daily_admission_ratio[category] = admission_ratios[category_num]
 
   return daily_admission_ratio, daily_msdrg_ratio
 
-def calculate_covid_changes(inpatient_data, daily_admission, daily_msdrg, procedure_type_list, admission_type_list, mdc_list, end_baseline_date, start_validation_date, end_validation_date, leap_year_date):
+def calculate_covid_changes(inpatient_values, inpatient_ma, category_index, inpatient_dates, daily_admission, daily_msdrg, procedure_type_list, admission_type_list, mdc_list, end_baseline_date, start_validation_date, end_validation_date):
   #Find the percentage of the 2018-2019 average that was experienced in 2020 for each admission type
-  tot_msdrg = {}#total msdrg
-  tot_admissions = {}#total admissions
-  #keep track of timeseries for 3 time periods (baseline: 1/1/20-3/10/20, series: 3/10/20-1/31/21, complete 1/1/20 - 1/31/21)
-  for x in ['baseline', 'series', 'complete']:
-    tot_msdrg[x] = {}
-    tot_admissions[x] = {}
-    #get group for each admission type (MED/SURG, EI/IP)
-    for procedure_type in procedure_type_list:
-      for admission_type in admission_type_list:
-        type_name = procedure_type + '_' + admission_type
-        tot_msdrg[x][type_name] = []
-        tot_admissions[x][type_name] = []
-    #also for each MDC group admission type (EI/IP, 1-26 + PRE + COVID)
-    for mdc_num in mdc_list:
-      for admit_form in admission_type_list:
-        tot_msdrg[x][admit_form + '_' + mdc_num] = []
-        tot_admissions[x][admit_form + '_' + mdc_num] = []
-    tot_msdrg[x]['COVID'] = []
-    tot_admissions[x]['COVID'] = []
- 
-  #begin simulation - covering period from the end of the baseline period (12/31/2019)
-  #through the end of the data period (2/1/2021)
-  current_date = end_baseline_date + timedelta(0)
-  complete_dates = []
-  x = 0
-  while current_date < end_validation_date:
-    if current_date > leap_year_date and current_date.year == 2020:
-      day_of_year = current_date.timetuple().tm_yday - 2
-    else:
-      day_of_year = current_date.timetuple().tm_yday - 1
-      
-    msdrg_baseline_doy = 0.0
-    admission_baseline_doy = 0.0
-    #get total admissions/msdrg
-    for procedure_type in procedure_type_list:
-      for admission_type in admission_type_list:
-        type_name = procedure_type + '_' + admission_type
-        msdrg_baseline_doy += daily_msdrg[type_name][day_of_year]
-        admission_baseline_doy += daily_admission[type_name][day_of_year]
-
-    #find admissions/msdrg as the % of the same day in 2018/19 for all of 2020 and 21
-    if current_date.year == 2020 or current_date.year == 2021:
-      complete_dates.append(current_date)
-      #find 2020-21 7-day MA as a % of the baseline from 2018
-      #for admissions - each group is presented as a % of total admissions on that day of the year
-      admission_baseline_doy = 0.0
-      msdrg_baseline_doy = 0.0
-      for procedure_type in procedure_type_list:
-        for admission_type in admission_type_list:
-          type_name = procedure_type + '_' + admission_type
-          admission_baseline_doy += daily_admission[type_name][day_of_year]# sum of all admission baseline values
-          msdrg_baseline_doy +=  daily_msdrg[type_name][day_of_year]# sum of all admission baseline values
-      
-      #find daily admissions as a % of the baseline from that day of the year in 2018 - 2019
-      for procedure_type in procedure_type_list:
-        for admission_type in admission_type_list:
-          type_name = procedure_type + '_' + admission_type
-          tot_admissions['complete'][type_name].append(inpatient_data.loc[current_date, 'ADMIT_' + type_name + '_MA']/admission_baseline_doy)
-          tot_msdrg['complete'][type_name].append(inpatient_data.loc[current_date, type_name + '_MA']/msdrg_baseline_doy)
-      for mdc_num in mdc_list:
-        for admit_form in admission_type_list:
-          admit_cat = admit_form + '_' + mdc_num
-          tot_admissions['complete'][admit_cat].append(inpatient_data.loc[current_date, 'ADMIT_'+ admit_cat + '_MA']/admission_baseline_doy)
-          tot_msdrg['complete'][admit_cat].append(inpatient_data.loc[current_date, admit_cat]/msdrg_baseline_doy)
-      
-      tot_admissions['complete']['COVID'].append(inpatient_data.loc[current_date, 'ADMIT_COVID_MA']/admission_baseline_doy)
-      tot_msdrg['complete']['COVID'].append(inpatient_data.loc[current_date, 'COVID_MA']/msdrg_baseline_doy)
-      
-    #if we are before 3/1/2020, find the 'baseline' % of 2018/19 admissions/msdrg that were being observed in 1/2020 and 2/2020, before covid happened
-    #(i.e., we want to know if we were starting 2020 at like 105% of 2018/19 levels to account for growth in the 'baseline' for 2020
-    #get timeseries of deviations from the baseline pre-covid (i.e., the pre-existing variability of the data)
-    if current_date < start_validation_date:
-      #what was the baseline (pre-covid) admission rate for covid-like admission codes (repiratory stuff)
-      tot_msdrg['baseline']['COVID'].append(max(inpatient_data.loc[current_date, 'COVID_MA'] - daily_msdrg['COVID'][day_of_year], 0.0)/msdrg_baseline_doy)
-      tot_admissions['baseline']['COVID'].append(max(inpatient_data.loc[current_date, 'ADMIT_COVID_MA'] - daily_admission['COVID'][day_of_year], 0.0)/admission_baseline_doy)
-      for procedure_type in procedure_type_list:
-        for admission_type in admission_type_list:
-          type_name = procedure_type + '_' + admission_type
-          if daily_msdrg[type_name][day_of_year] > 0.0:
-            tot_msdrg['baseline'][type_name].append(inpatient_data.loc[current_date, type_name + '_MA']/daily_msdrg[type_name][day_of_year])
-          else:
-            tot_msdrg['baseline'][type_name].append(0.0)
-          if daily_admission[type_name][day_of_year] > 0.0:
-            tot_admissions['baseline'][type_name].append(inpatient_data.loc[current_date, 'ADMIT_' + type_name + '_MA']/daily_admission[type_name][day_of_year])
-          else:
-            tot_admissions['baseline'][type_name].append(0.0)
-          
-      for mdc_num in mdc_list:
-        for admit_form in admission_type_list:
-          admit_cat = admit_form + '_' + mdc_num
-          if daily_admission[admit_cat][day_of_year] > 0.0:
-            tot_admissions['baseline'][admit_cat].append(inpatient_data.loc[current_date, 'ADMIT_' + admit_cat]/(daily_admission[admit_cat][day_of_year]))
-          else:
-            tot_admissions['baseline'][admit_cat].append(0.0)
-          if daily_msdrg[admit_cat][day_of_year] > 0.0:
-            tot_msdrg['baseline'][admit_cat].append(inpatient_data.loc[current_date, admit_cat]/(daily_msdrg[admit_cat][day_of_year]))
-          else:
-            tot_msdrg['baseline'][admit_cat].append(0.0)
-    #after 3/1/2020, do the same thing as above but create a seperate 'covid' series   
-    else:
-      tot_msdrg['series']['COVID'].append(max(inpatient_data.loc[current_date, 'COVID_MA'] - daily_msdrg['COVID'][day_of_year], 0.0))
-      tot_admissions['series']['COVID'].append(max(inpatient_data.loc[current_date, 'ADMIT_COVID_MA'] - daily_admission['COVID'][day_of_year], 0.0))
-      for procedure_type in procedure_type_list:
-        for admission_type in admission_type_list:
-          type_name = procedure_type + '_' + admission_type
-          if daily_msdrg[type_name][day_of_year] > 0.0:
-            tot_msdrg['series'][type_name].append(inpatient_data.loc[current_date, type_name + '_MA'])
-          else:
-            tot_msdrg['series'][type_name].append(0.0)
-          if daily_admission[type_name][day_of_year] > 0.0:
-            tot_admissions['series'][type_name].append(inpatient_data.loc[current_date, 'ADMIT_' + type_name + '_MA'])
-          else:
-            tot_admissions['series'][type_name].append(0.0)
-      for mdc_num in mdc_list:
-        for admit_form in admission_type_list:
-          admit_cat = admit_form + '_' + mdc_num
-          tot_admissions['series'][admit_cat].append(inpatient_data.loc[current_date, 'ADMIT_'+ admit_cat + '_MA'])
-          tot_msdrg['series'][admit_cat].append(inpatient_data.loc[current_date, admit_cat + '_MA'])
-      
-    x += 1
-    current_date = end_baseline_date + timedelta(x)
-
-  #recast baseline series as a numpy array
+  #covering period from the end of the baseline period (12/31/2019) through the end of the data period (2/1/2021)
+  #every day of the period is found at once as slices of the (category x [msdrg, admissions] x day) arrays
+  period_days = np.arange((end_baseline_date - inpatient_dates['start']).days, (end_validation_date - inpatient_dates['start']).days)
+  period_dates = inpatient_dates['dates'][period_days]
+  period_years = period_dates.astype('datetime64[Y]').astype(int) + 1970
+  #2/29/2020 uses the same day of the year as 3/1/2020
+  day_of_year = inpatient_dates['day_of_year_365'][period_days]
+  period_ma = inpatient_ma[:, :, period_days]
+  period_values = inpatient_values[:, :, period_days]
+  
+  #2018/19 day-of-year averages for every category on each day of the period
+  period_seasonal = np.zeros(period_ma.shape)
+  for category in category_index:
+    period_seasonal[category_index[category], 0] = daily_msdrg[category][day_of_year]
+    period_seasonal[category_index[category], 1] = daily_admission[category][day_of_year]
+  #sum of the 4-category baseline values - each group is presented as a % of total admissions/msdrg on that day of the year
+  baseline_doy = np.zeros((2, len(period_days)))
   for procedure_type in procedure_type_list:
     for admission_type in admission_type_list:
-      type_name = procedure_type + '_' + admission_type
-      tot_admissions['complete'][type_name] = np.asarray(tot_admissions['complete'][type_name])
-      tot_msdrg['complete'][type_name] = np.asarray(tot_msdrg['complete'][type_name])
+      baseline_doy += period_seasonal[category_index[procedure_type + '_' + admission_type]]
+  mdc_categories = []
   for mdc_num in mdc_list:
     for admit_form in admission_type_list:
-      admit_cat = admit_form + '_' + mdc_num
-      tot_admissions['complete'][admit_cat] = np.asarray(tot_admissions['complete'][admit_cat])
-      tot_msdrg['complete'][admit_cat] = np.asarray(tot_msdrg['complete'][admit_cat])
-  tot_admissions['complete']['COVID'] = np.asarray(tot_admissions['complete']['COVID'])
-  tot_msdrg['complete']['COVID'] = np.asarray(tot_msdrg['complete']['COVID'])
+      mdc_categories.append(category_index[admit_form + '_' + mdc_num])
+  covid_num = category_index['COVID']
+  covid_excess = np.maximum(period_ma[covid_num] - period_seasonal[covid_num], 0.0)
+  
+  #keep track of timeseries for 3 time periods (baseline: 1/1/20-3/1/20, series: 3/1/20-1/31/21, complete 1/1/20 - 1/31/21)
+  #find admissions/msdrg as the % of the same day in 2018/19 for all of 2020 and 21
+  #(msdrg for the MDC groups uses the daily values, not the 7-day MA)
+  complete_days = (period_years == 2020) | (period_years == 2021)
+  complete_values = period_ma.copy()
+  complete_values[mdc_categories, 0] = period_values[mdc_categories, 0]
+  complete_values = complete_values[:, :, complete_days] / baseline_doy[:, complete_days]
+  
+  #before 3/1/2020, find the 'baseline' % of 2018/19 admissions/msdrg that were being observed in 1/2020 and 2/2020, before covid happened
+  #(i.e., we want to know if we were starting 2020 at like 105% of 2018/19 levels to account for growth in the 'baseline' for 2020
+  #get timeseries of deviations from the baseline pre-covid (i.e., the pre-existing variability of the data)
+  #days with no baseline admissions/msdrg on that day of the year are set to zero
+  #(MDC groups use the daily values, not the 7-day MA)
+  baseline_days = period_dates < np.datetime64(start_validation_date, 'D')
+  baseline_values = period_ma.copy()
+  baseline_values[mdc_categories] = period_values[mdc_categories]
+  with np.errstate(divide = 'ignore', invalid = 'ignore'):
+    baseline_values = np.where(period_seasonal > 0.0, baseline_values / period_seasonal, 0.0)[:, :, baseline_days]
+  #what was the baseline (pre-covid) admission rate for covid-like admission codes (repiratory stuff)
+  baseline_values[covid_num] = covid_excess[:, baseline_days] / baseline_doy[:, baseline_days]
+  
+  #after 3/1/2020, do the same thing as above but create a seperate 'covid' series of the raw 7-day MA
+  series_values = np.where(period_seasonal > 0.0, period_ma, 0.0)
+  series_values[mdc_categories] = period_ma[mdc_categories]
+  series_values[covid_num] = covid_excess
+  series_values = series_values[:, :, ~baseline_days]
+  
+  tot_msdrg = {}#total msdrg
+  tot_admissions = {}#total admissions
+  for window_name, window_values in zip(['baseline', 'series', 'complete'], [baseline_values, series_values, complete_values]):
+    tot_msdrg[window_name] = {}
+    tot_admissions[window_name] = {}
+    for category in category_index:
+      tot_msdrg[window_name][category] = window_values[category_index[category], 0]
+      tot_admissions[window_name][category] = window_values[category_index[category], 1]
   
   return tot_admissions, tot_msdrg
 
-def calibrate_msdrg_codes(admission_type_series, msdrg_series, daily_admissions, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, admission_type_list, mdc_list, period_range, timeseries_start):
+def calibrate_msdrg_codes(admission_type_series, msdrg_series, daily_admissions, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, admission_type_list, mdc_list, period_range, timeseries_start, num_workers = 1, fit_method = 'curve_fit'):
   #this function calibrates 3 curves (for 3 distinct periods) that estimate the change through tim in admissions/msdrg for each admission type
   #the three periods include:
   #period 1 - reduction in admissions/msdrg immediately after non-emergency procedure cancellations
@@ -540,8 +742,9 @@ def calibrate_msdrg_codes(admission_type_series, msdrg_series, daily_admissions,
 
   msdrg_per_admit = {}
   #create loop to calibrate segmented admission functions for each admit type
-  all_obs = np.zeros(365)
-  all_pred = np.zeros(365)
+  #the three periods are chained within each admit type, but admit types are independent of each other
+  #so each admit type can be fit with curve_fit in a seperate worker process (fit_method = 'curve_fit', the default), or all admit types can be fit together (fit_method = 'batch')
+  category_list = []
   for mdc_num in mdc_list:
     for admit_type in admission_type_list:
       admit_cat = admit_type + '_' + mdc_num
@@ -558,91 +761,239 @@ def calibrate_msdrg_codes(admission_type_series, msdrg_series, daily_admissions,
       new_admission_series[end_of_calendar_year:] = admission_type_series[admit_cat][end_of_calendar_year:] - daily_admissions[admit_cat][:(len(new_admission_series) - end_of_calendar_year)] * daily_admission_ratio[admit_cat]
       new_msdrg_series[:end_of_calendar_year] = msdrg_series[admit_cat][:end_of_calendar_year] - daily_msdrg[admit_cat][doy_start_timeseries:] * daily_msdrg_ratio[admit_cat]
       new_msdrg_series[end_of_calendar_year:] = msdrg_series[admit_cat][end_of_calendar_year:] - daily_msdrg[admit_cat][:(len(new_admission_series) - end_of_calendar_year)] * daily_msdrg_ratio[admit_cat]
-      
-      for period_num, period_direction in zip(['1', '2', '3'], [False, True, False]):
-        #get beginning and ending values for curve-fitting
-        start_date1 = period_range[period_num]['start'][0]
-        start_date2 = period_range[period_num]['start'][1]
-        end_date1 = period_range[period_num]['end'][0]
-        end_date2 = period_range[period_num]['end'][1]
-        type_start = np.mean(new_admission_series[start_date1:start_date2])
-        type_end = np.mean(new_admission_series[end_date1:end_date2])     
-        period_admission_series = np.zeros(end_date2 - start_date1)
-        
-        #seperate out admissions from each period from the overall record
-        for xxx in range(start_date1, end_date2):
-          period_admission_series[xxx-start_date1] = new_admission_series[xxx] * 1.0
-        if period_num == '1':        
-          try:
-            #fit logit function to the data from the segment
-            popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_admission_series, p0 = (type_start, type_end, 1.0, 10.0), maxfev = 50000)
-          except:
-            popt = (type_start, type_end, 0.1, (end_date2 - start_date1) / 2.0)#default function parameters
+      category_list.append((mdc_num, admit_type, new_admission_series, new_msdrg_series, period_range))
 
-        else:
-          try:
-            epsilon = 0.000001
-            #use end_val (function_parameters['e_1']) from previous segment as the 'start_val' for this segment
-            popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_admission_series, p0 = (final_val, type_end, 1.0, 10.0 + start_date1), bounds = ([final_val - epsilon, -9999, 0.1, 0.0], [final_val + epsilon, 9999, 100.0, end_date2 - start_date1]), maxfev = 50000)
-          except:
+  #fit each admit type, then merge the parameters back in mdc/admit type order
+  if fit_method == 'batch':
+    fitted_parameters = calibrate_batch_sigmoids([x[0] for x in category_list], [x[1] for x in category_list], np.vstack([x[2] for x in category_list]), np.vstack([x[3] for x in category_list]), period_range)
+  elif num_workers > 1:
+    with ProcessPoolExecutor(max_workers = num_workers, mp_context = get_calibration_context()) as executor:
+      fitted_parameters = list(executor.map(calibrate_category_sigmoids, *zip(*category_list)))
+  else:
+    fitted_parameters = list(map(calibrate_category_sigmoids, *zip(*category_list)))
+  #fit_report records whether each curve converged and its sum of squared residuals, with the same keys as function_parameters
+  fit_report = {}
+  for report_key in ['converged', 'residual']:
+    fit_report[report_key + '_1'] = {}
+    fit_report[report_key + '_2'] = {}
+  for category_parameters, category_report in fitted_parameters:
+    for param_key in category_parameters:
+      function_parameters[param_key].update(category_parameters[param_key])
+    for report_key in category_report:
+      fit_report[report_key].update(category_report[report_key])
+  #the fitted parameters are returned as a dense (period x category x target x [s, e, x, z]) array, see make_parameter_tensor
+  parameter_tensor = make_parameter_tensor(function_parameters, admission_type_list, mdc_list)
+
+  return parameter_tensor, new_msdrg_series, fit_report
+
+def make_parameter_tensor(function_parameters, admission_type_list, mdc_list):
+  #this function copies the logit parameters from function_parameters (keyed by 'P' + period + '_' + mdc + '_' + admit type, for 's_1', 'e_1', ... 'z_2')
+  #into a dense (period x category x target x [s, e, x, z]) array - periods 1-3 are [0, 1, 2], targets are admissions ('_1') = 0 and msdrg per admit ('_2') = 1,
+  #and categories are ordered like icu_coefs (mdc major, admit type minor), so category mdc_cnt * len(admission_type_list) + adm_cnt is admit_type + '_' + mdc_num
+  parameter_list = ['s', 'e', 'x', 'z']
+  parameter_tensor = np.zeros((3, len(mdc_list) * len(admission_type_list), 2, len(parameter_list)))
+  for period_cnt in range(0, 3):
+    for mdc_cnt, mdc_num in enumerate(mdc_list):
+      for adm_cnt, admit_type in enumerate(admission_type_list):
+        param_use = 'P' + str(period_cnt + 1) + '_' + mdc_num + '_' + admit_type
+        for target_cnt in range(0, 2):
+          for param_cnt, par in enumerate(parameter_list):
+            parameter_tensor[period_cnt, mdc_cnt * len(admission_type_list) + adm_cnt, target_cnt, param_cnt] = function_parameters[par + '_' + str(target_cnt + 1)][param_use]
+  return parameter_tensor
+
+def make_parameter_dict(parameter_tensor, admission_type_list, mdc_list):
+  #this function makes the string-keyed function_parameters dictionary ('s_1', 'e_1', ... 'z_2' -> 'P' + period + '_' + mdc + '_' + admit type) from a parameter tensor
+  #(values are copied, the parameter tensor is what the simulations read)
+  #(keys are in the same order as the dictionaries made by calibrate_msdrg_codes)
+  parameter_list = ['s', 'e', 'x', 'z']
+  function_parameters = {}
+  for param_cnt, par in enumerate(parameter_list):
+    for target_cnt in range(0, 2):
+      function_parameters[par + '_' + str(target_cnt + 1)] = {}
+      for mdc_cnt, mdc_num in enumerate(mdc_list):
+        for adm_cnt, admit_type in enumerate(admission_type_list):
+          for period_cnt in range(0, 3):
+            function_parameters[par + '_' + str(target_cnt + 1)]['P' + str(period_cnt + 1) + '_' + mdc_num + '_' + admit_type] = parameter_tensor[period_cnt, mdc_cnt * len(admission_type_list) + adm_cnt, target_cnt, param_cnt]
+  return function_parameters
+
+def get_calibration_context():
+  #worker processes are forked where the platform allows it, so the calling script is not re-run by every worker
+  if 'fork' in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context('fork')
+  return multiprocessing.get_context()
+
+def calibrate_category_sigmoids(mdc_num, admit_type, new_admission_series, new_msdrg_series, period_range):
+  #this function calibrates the 3 chained sigmoid curves for admissions ('_1') and msdrg ('_2') of a single admit type
+  #returns dictionaries with the same keys as function_parameters and fit_report, holding only this admit type's parameters
+  #(a fit that raises an error falls back to default parameters and is reported as not converged)
+  parameter_list = ['s', 'e', 'x', 'z']
+  category_parameters = {}
+  category_report = {}
+  for par in parameter_list:
+    category_parameters[par + '_1'] = {}
+    category_parameters[par + '_2'] = {}
+  for report_key in ['converged', 'residual']:
+    category_report[report_key + '_1'] = {}
+    category_report[report_key + '_2'] = {}
+
+  for period_num, period_direction in zip(['1', '2', '3'], [False, True, False]):
+    #get beginning and ending values for curve-fitting
+    start_date1 = period_range[period_num]['start'][0]
+    start_date2 = period_range[period_num]['start'][1]
+    end_date1 = period_range[period_num]['end'][0]
+    end_date2 = period_range[period_num]['end'][1]
+    type_start = np.mean(new_admission_series[start_date1:start_date2])
+    type_end = np.mean(new_admission_series[end_date1:end_date2])     
+    period_admission_series = np.zeros(end_date2 - start_date1)
+    
+    #seperate out admissions from each period from the overall record
+    for xxx in range(start_date1, end_date2):
+      period_admission_series[xxx-start_date1] = new_admission_series[xxx] * 1.0
+    if period_num == '1':        
+      try:
+        #fit logit function to the data from the segment
+        popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_admission_series, p0 = (type_start, type_end, 1.0, 10.0), maxfev = 50000)
+        fit_converged = True
+      except:
+        popt = (type_start, type_end, 0.1, (end_date2 - start_date1) / 2.0)#default function parameters
+        fit_converged = False
+
+    else:
+      try:
+        epsilon = 0.000001
+        #use end_val (function_parameters['e_1']) from previous segment as the 'start_val' for this segment
+        popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_admission_series, p0 = (final_val, type_end, 1.0, 10.0 + start_date1), bounds = ([final_val - epsilon, -9999, 0.1, 0.0], [final_val + epsilon, 9999, 100.0, end_date2 - start_date1]), maxfev = 50000)
+        fit_converged = True
+      except:
 #            try:
 #              popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_admission_series, p0 = (type_start, type_end, 1.0, 10.0), maxfev = 50000)
 #            except:
-            popt = (final_val, type_end, 0.1, (end_date2 - start_date1) / 2.0)
-        
-        current_parameter_category = 'P' + period_num + '_' + str(mdc_num) + '_' + admit_type
-        for param_cnt, param_use in enumerate(parameter_list):
-          function_parameters[param_use + '_1'][current_parameter_category] = popt[param_cnt] * 1.0
-        #seperate out average msdrg from each period from the overall record
-        #seperate out average msdrg from each period from the overall record
-        est_vals = []
-        for x in range(start_date1, end_date2):
-          estimate = estimate_logit_syn(x - start_date1, function_parameters['s_1'][current_parameter_category], function_parameters['e_1'][current_parameter_category], function_parameters['x_1'][current_parameter_category], function_parameters['z_1'][current_parameter_category])
-          est_vals.append(estimate)
-          all_pred[x] += estimate
-          all_obs[x] += period_admission_series[x-start_date1]
-        final_val = estimate_logit_syn(end_date1 - start_date1, function_parameters['s_1'][current_parameter_category], function_parameters['e_1'][current_parameter_category], function_parameters['x_1'][current_parameter_category], function_parameters['z_1'][current_parameter_category])
-        
-      for period_num, period_direction in zip(['1', '2', '3'], [False, True, False]):
-        #get beginning and ending values for curve-fitting
-        start_date1 = period_range[period_num]['start'][0]
-        start_date2 = period_range[period_num]['start'][1]
-        end_date1 = period_range[period_num]['end'][0]
-        end_date2 = period_range[period_num]['end'][1]
-        type_start = np.mean(new_msdrg_series[start_date1:start_date2])
-        type_end = np.mean(new_msdrg_series[end_date1:end_date2])             
-        period_msdrg_series = np.zeros(end_date2 - start_date1)
-        for xxx in range(start_date1, end_date2):
-          period_msdrg_series[xxx-start_date1] = new_msdrg_series[xxx] * 1.0
-        if period_num == '1':        
-          try:
-            #fit logic function to the data from the current segment
-            popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_msdrg_series, p0 = (type_start, type_end, 1.0, 10.0), maxfev = 50000)
-          except:
-            popt = (type_start, type_end, 1, (end_date2 - start_date1) / 2.0)
+        popt = (final_val, type_end, 0.1, (end_date2 - start_date1) / 2.0)
+        fit_converged = False
+    
+    current_parameter_category = 'P' + period_num + '_' + str(mdc_num) + '_' + admit_type
+    for param_cnt, param_use in enumerate(parameter_list):
+      category_parameters[param_use + '_1'][current_parameter_category] = popt[param_cnt] * 1.0
+    category_report['converged_1'][current_parameter_category] = fit_converged
+    category_report['residual_1'][current_parameter_category] = np.sum(np.power(period_admission_series - estimate_logit_syn(np.arange(end_date2 - start_date1), *popt), 2))
+    final_val = estimate_logit_syn(end_date1 - start_date1, category_parameters['s_1'][current_parameter_category], category_parameters['e_1'][current_parameter_category], category_parameters['x_1'][current_parameter_category], category_parameters['z_1'][current_parameter_category])
+    
+  for period_num, period_direction in zip(['1', '2', '3'], [False, True, False]):
+    #get beginning and ending values for curve-fitting
+    start_date1 = period_range[period_num]['start'][0]
+    start_date2 = period_range[period_num]['start'][1]
+    end_date1 = period_range[period_num]['end'][0]
+    end_date2 = period_range[period_num]['end'][1]
+    type_start = np.mean(new_msdrg_series[start_date1:start_date2])
+    type_end = np.mean(new_msdrg_series[end_date1:end_date2])             
+    period_msdrg_series = np.zeros(end_date2 - start_date1)
+    for xxx in range(start_date1, end_date2):
+      period_msdrg_series[xxx-start_date1] = new_msdrg_series[xxx] * 1.0
+    if period_num == '1':        
+      try:
+        #fit logic function to the data from the current segment
+        popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_msdrg_series, p0 = (type_start, type_end, 1.0, 10.0), maxfev = 50000)
+        fit_converged = True
+      except:
+        popt = (type_start, type_end, 1, (end_date2 - start_date1) / 2.0)
+        fit_converged = False
+
+    else:
+      try:
+        epsilon = 0.000001
+        #use end_val (function_parameters['e_1']) from previous segment as the 'start_val' for this segment
+        popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_msdrg_series, p0 = (final_val, type_end,  1.0, (end_date2 - start_date1)/2.0), bounds = ([final_val - epsilon, -9999, 0.1, 0.0], [final_val + epsilon, 9999, 100.0, end_date2 - start_date1]),  maxfev = 50000)
+        fit_converged = True
+      except:
+        popt = (type_start, type_end,  1, (end_date2 - start_date1) / 2.0)
+        fit_converged = False
+    current_parameter_category = 'P' + period_num + '_' + str(mdc_num) + '_' + admit_type
+    for param_cnt, param_use in enumerate(parameter_list):
+      if param_cnt < 2:
+        category_parameters[param_use + '_2'][current_parameter_category] = popt[param_cnt] * 1.0
+      else:
+        category_parameters[param_use + '_2'][current_parameter_category] = popt[param_cnt] * 1.0
+    category_report['converged_2'][current_parameter_category] = fit_converged
+    category_report['residual_2'][current_parameter_category] = np.sum(np.power(period_msdrg_series - estimate_logit_syn(np.arange(end_date2 - start_date1), *popt), 2))
+    final_val = estimate_logit_syn(end_date1 - start_date1, category_parameters['s_2'][current_parameter_category], category_parameters['e_2'][current_parameter_category], category_parameters['x_2'][current_parameter_category], category_parameters['z_2'][current_parameter_category])
+
+  return category_parameters, category_report
+
+def calibrate_batch_sigmoids(mdc_nums, admit_types, admission_stack, msdrg_stack, period_range):
+  #this function calibrates the 3 chained sigmoid curves for admissions ('_1') and msdrg ('_2') of every admit type at once
+  #admission_stack and msdrg_stack are (admit type x day) arrays, each period is fit for all admit types with one call to fit_logit_batch
+  #returns a list of (category_parameters, category_report) for each admit type, like calibrate_category_sigmoids
+  parameter_list = ['s', 'e', 'x', 'z']
+  num_categories = len(mdc_nums)
+  fitted_parameters = []
+  for x in range(0, num_categories):
+    category_parameters = {}
+    category_report = {}
+    for par in parameter_list:
+      category_parameters[par + '_1'] = {}
+      category_parameters[par + '_2'] = {}
+    for report_key in ['converged', 'residual']:
+      category_report[report_key + '_1'] = {}
+      category_report[report_key + '_2'] = {}
+    fitted_parameters.append((category_parameters, category_report))
 
+  for target_num, target_series in zip(['1', '2'], [admission_stack, msdrg_stack]):
+    for period_num in ['1', '2', '3']:
+      #get beginning and ending values for curve-fitting
+      start_date1 = period_range[period_num]['start'][0]
+      start_date2 = period_range[period_num]['start'][1]
+      end_date1 = period_range[period_num]['end'][0]
+      end_date2 = period_range[period_num]['end'][1]
+      type_start = np.mean(target_series[:, start_date1:start_date2], axis = 1)
+      type_end = np.mean(target_series[:, end_date1:end_date2], axis = 1)
+      #seperate out admissions/msdrg from each period from the overall record
+      period_series = target_series[:, start_date1:end_date2]
+      #sigmoid fits have many local minima, so each period is fit from several starting points and the best fit is kept
+      #starting points are the curve_fit initial guess, the old default parameters, and a grid of midpoints/slopes
+      period_length = float(end_date2 - start_date1)
+      if period_num == '1':
+        start_val = type_start
+        lower_bounds = np.full(4, -np.inf)
+        upper_bounds = np.full(4, np.inf)
+        initial_z = 10.0
+        if target_num == '1':
+          default_x = 0.1
         else:
-          try:
-            epsilon = 0.000001
-            #use end_val (function_parameters['e_1']) from previous segment as the 'start_val' for this segment
-            popt, pcov = curve_fit(f = estimate_logit_syn, xdata = np.arange(end_date2 - start_date1), ydata = period_msdrg_series, p0 = (final_val, type_end,  1.0, (end_date2 - start_date1)/2.0), bounds = ([final_val - epsilon, -9999, 0.1, 0.0], [final_val + epsilon, 9999, 100.0, end_date2 - start_date1]),  maxfev = 50000)
-          except:
-            popt = (type_start, type_end,  1, (end_date2 - start_date1) / 2.0)
+          default_x = 1.0
+      else:
+        #use end_val from previous segment as the (fixed) 'start_val' for this segment
+        start_val = final_val
+        lower_bounds = np.column_stack([final_val, np.full(num_categories, -9999.0), np.full(num_categories, 0.1), np.full(num_categories, 0.0)])
+        upper_bounds = np.column_stack([final_val, np.full(num_categories, 9999.0), np.full(num_categories, 100.0), np.full(num_categories, period_length)])
+        if target_num == '1':
+          initial_z = 10.0 + start_date1
+          default_x = 0.1
+        else:
+          initial_z = period_length / 2.0
+          default_x = 1.0
+      start_list = [(1.0, initial_z), (default_x, period_length / 2.0)]
+      for grid_z in [0.25, 0.5, 0.75]:
+        for grid_x in [0.3, 3.0]:
+          start_list.append((grid_x, grid_z * period_length))
+      initial_parameters = np.vstack([np.column_stack([start_val, type_end, np.full(num_categories, start_x), np.full(num_categories, start_z)]) for start_x, start_z in start_list])
+      num_starts = len(start_list)
+      popt, fit_converged, fit_iterations, fit_residual = fit_logit_batch(np.arange(end_date2 - start_date1), np.tile(period_series, (num_starts, 1)), initial_parameters, np.tile(np.broadcast_to(lower_bounds, (num_categories, 4)), (num_starts, 1)), np.tile(np.broadcast_to(upper_bounds, (num_categories, 4)), (num_starts, 1)))
+      #keep the starting point with the lowest sum of squared residuals for each admit type
+      best_start = np.argmin(np.where(np.isfinite(fit_residual), fit_residual, np.inf).reshape(num_starts, num_categories), axis = 0) * num_categories + np.arange(num_categories)
+      popt = popt[best_start]
+      fit_converged = fit_converged[best_start]
+      fit_residual = fit_residual[best_start]
+
+      for cat_cnt, (mdc_num, admit_type) in enumerate(zip(mdc_nums, admit_types)):
+        category_parameters, category_report = fitted_parameters[cat_cnt]
         current_parameter_category = 'P' + period_num + '_' + str(mdc_num) + '_' + admit_type
         for param_cnt, param_use in enumerate(parameter_list):
-          if param_cnt < 2:
-            function_parameters[param_use + '_2'][current_parameter_category] = popt[param_cnt] * 1.0
-          else:
-            function_parameters[param_use + '_2'][current_parameter_category] = popt[param_cnt] * 1.0
-        est_vals = []
-        for x in range(start_date1, end_date2):
-          estimate = estimate_logit_syn(x - start_date1, function_parameters['s_2'][current_parameter_category], function_parameters['e_2'][current_parameter_category], function_parameters['x_2'][current_parameter_category], function_parameters['z_2'][current_parameter_category])
-          est_vals.append(estimate)
-          all_pred[x] += estimate
-          all_obs[x] += period_msdrg_series[x-start_date1]
-        final_val = estimate_logit_syn(end_date1 - start_date1, function_parameters['s_2'][current_parameter_category], function_parameters['e_2'][current_parameter_category], function_parameters['x_2'][current_parameter_category], function_parameters['z_2'][current_parameter_category])
-
-  return function_parameters, new_msdrg_series
+          category_parameters[param_use + '_' + target_num][current_parameter_category] = popt[cat_cnt, param_cnt] * 1.0
+        category_report['converged_' + target_num][current_parameter_category] = fit_converged[cat_cnt]
+        category_report['residual_' + target_num][current_parameter_category] = fit_residual[cat_cnt]
+      final_val = estimate_logit_syn(end_date1 - start_date1, popt[:, 0], popt[:, 1], popt[:, 2], popt[:, 3])
+
+  return fitted_parameters
 
 def estimate_logit_syn(current_date, start_val, end_val, min_x, min_z):
   #logit function for optimization
@@ -650,57 +1001,145 @@ def estimate_logit_syn(current_date, start_val, end_val, min_x, min_z):
 
   return logit_val
 
+def estimate_logit_jacobian(current_date, start_val, end_val, min_x, min_z):
+  #partial derivatives of estimate_logit_syn with respect to [s, e, x, z], stacked along the last axis
+  logit_weight = expit(min_x * (current_date - min_z))
+  logit_slope = (start_val - end_val) * logit_weight * (1.0 - logit_weight)
+  return np.stack([1.0 - logit_weight, logit_weight, -1.0 * logit_slope * (current_date - min_z), logit_slope * min_x], axis = -1)
 
-def get_admissions_standards(prob_type_list, machine_type_list):
+def fit_logit_batch(xdata, ydata, initial_parameters, lower_bounds, upper_bounds, max_iterations = 200, ftol = 1.49012e-08, xtol = 1.49012e-08):
+  #this function fits estimate_logit_syn to many series at once with a batched Levenberg-Marquardt solver
+  #xdata is (day), ydata is (series x day), initial_parameters is (series x [s, e, x, z]), bounds are [s, e, x, z] or (series x [s, e, x, z])
+  #parameters with equal lower and upper bounds are held fixed (i.e., a start value pinned to the end of the previous segment)
+  #other bounded parameters are kept in bounds by projecting each step back onto the bounds
+  #returns the fitted parameters and, for each series, whether the fit converged, the number of iterations, and the sum of squared residuals
+  num_series = ydata.shape[0]
+  lower_bounds = np.broadcast_to(np.asarray(lower_bounds, dtype = float), (num_series, 4))
+  upper_bounds = np.broadcast_to(np.asarray(upper_bounds, dtype = float), (num_series, 4))
+  free_parameters = upper_bounds > lower_bounds
+  parameters = np.clip(np.asarray(initial_parameters, dtype = float), lower_bounds, upper_bounds)
+  residuals = ydata - estimate_logit_syn(xdata, parameters[:, 0:1], parameters[:, 1:2], parameters[:, 2:3], parameters[:, 3:4])
+  cost = np.sum(np.power(residuals, 2), axis = 1)
+  damping = np.full(num_series, 0.001)
+  converged = np.zeros(num_series, dtype = bool)
+  iterations = np.zeros(num_series, dtype = int)
+  active = np.isfinite(cost)
+  for iteration in range(0, max_iterations):
+    if not np.any(active):
+      break
+    fit_index = np.flatnonzero(active)
+    current = parameters[fit_index]
+    #gauss-newton system from the closed-form jacobian (fixed parameters have no jacobian column)
+    jacobian = estimate_logit_jacobian(xdata, current[:, 0:1], current[:, 1:2], current[:, 2:3], current[:, 3:4]) * free_parameters[fit_index][:, np.newaxis, :]
+    jacobian_t = np.swapaxes(jacobian, 1, 2)
+    jtj = np.matmul(jacobian_t, jacobian)
+    jtr = np.matmul(jacobian_t, residuals[fit_index][:, :, np.newaxis])[:, :, 0]
+    jtj_diagonal = np.diagonal(jtj, axis1 = 1, axis2 = 2)
+    #marquardt scaling of the damping term, with a unit diagonal for fixed parameters so the system stays solvable
+    damped_diagonal = damping[fit_index][:, np.newaxis] * np.maximum(jtj_diagonal, 1e-12) + np.logical_not(free_parameters[fit_index])
+    step = np.linalg.solve(jtj + damped_diagonal[:, :, np.newaxis] * np.eye(4), jtr[:, :, np.newaxis])[:, :, 0]
+    trial = np.clip(current + step, lower_bounds[fit_index], upper_bounds[fit_index])
+    trial_residuals = ydata[fit_index] - estimate_logit_syn(xdata, trial[:, 0:1], trial[:, 1:2], trial[:, 2:3], trial[:, 3:4])
+    trial_cost = np.sum(np.power(trial_residuals, 2), axis = 1)
+    improved = trial_cost < cost[fit_index]
+    #converge on a small relative change in cost or parameters
+    step_size = np.sqrt(np.sum(np.power(trial - current, 2), axis = 1))
+    small_step = step_size <= xtol * (np.sqrt(np.sum(np.power(current, 2), axis = 1)) + xtol)
+    small_reduction = improved & (cost[fit_index] - trial_cost <= ftol * cost[fit_index])
+    #accept steps that lower the cost and relax the damping, otherwise increase the damping
+    accepted = fit_index[improved]
+    parameters[accepted] = trial[improved]
+    residuals[accepted] = trial_residuals[improved]
+    cost[accepted] = trial_cost[improved]
+    damping[fit_index] = np.where(improved, damping[fit_index] * 0.1, damping[fit_index] * 10.0)
+    iterations[fit_index] += 1
+    finished = small_step | small_reduction | (cost[fit_index] == 0.0)
+    converged[fit_index[finished]] = True
+    active[fit_index[finished]] = False
+
+  return parameters, converged, iterations, cost
+
+
+def get_calibration_artifacts(regional_census, procedure_type_list, admission_type_list, mdc_list, period_range, start_value, calibration_start, calibration_end, capacity_ratio, prob_type_list, machine_type_list, num_workers = 1, fit_method = 'curve_fit', inpatient_file = 'aggregated_inpatient_values.csv', cache_folder = 'calibration_cache'):
+  #this function returns the calibrated admission curves (calibrate_msdrg_changes), icu coefficients (calibrate_icu_census),
+  #and oxygen use survival probabilities (get_admissions_standards) as a dictionary
+  #admission curve parameters are in 'parameter_tensor' (see make_parameter_tensor), with the string-keyed 'function_parameters' made from it (make_parameter_dict)
+  #results are saved in cache_folder, keyed on a hash of the input files, regional census, and calibration settings,
+  #so recalibration is skipped entirely when none of the inputs have changed
+  source_files = [inpatient_file, 'ms_drgs.csv'] + sorted(glob.glob('oxygen_use_data/*.csv'))
+  #artifact_version changes whenever the layout of the cached artifacts changes, so older caches are not read
+  artifact_version = 4
+  cache_settings = [artifact_version, procedure_type_list, admission_type_list, mdc_list, period_range, start_value, calibration_start, calibration_end, capacity_ratio, prob_type_list, machine_type_list, fit_method, regional_census]
+  cache_key = make_content_cache_key(source_files, cache_settings)
+  calibration_artifacts = read_artifact_cache(cache_folder, cache_key)
+  if calibration_artifacts is not None:
+    #calibrate_icu_census also fills in missing covid icu census data, so do that here when it is skipped
+    fill_covid_icu_census(regional_census)
+    for cohort_key in calibration_artifacts['survival_cohorts']:
+      calibration_artifacts['survival_cohorts'][cohort_key].flags.writeable = False
+    calibration_artifacts['parameter_tensor'].flags.writeable = False
+    calibration_artifacts['function_parameters'] = make_parameter_dict(calibration_artifacts['parameter_tensor'], admission_type_list, mdc_list)
+    return calibration_artifacts
+
+  calibration_artifacts = {}
+  inpatient_data = pd.read_csv(inpatient_file)
+  calibration_list = calibrate_msdrg_changes(inpatient_data, procedure_type_list, admission_type_list, mdc_list, period_range, start_value, capacity_ratio, num_workers = num_workers, fit_method = fit_method)
+  for calibration_name, calibration_values in zip(['daily_admissions', 'daily_msdrg', 'daily_admission_ratio', 'daily_msdrg_ratio', 'tot_admissions', 'tot_msdrg', 'msdrg_per_admit', 'parameter_tensor', 'fit_report'], calibration_list):
+    calibration_artifacts[calibration_name] = calibration_values
+  calibration_artifacts['icu_coefs'] = calibrate_icu_census(regional_census, calibration_artifacts['tot_admissions']['series'], start_value, calibration_start, calibration_end, admission_type_list, mdc_list)
+  calibration_artifacts['survival_cohorts'] = get_admissions_standards(prob_type_list, machine_type_list)
+  write_artifact_cache(calibration_artifacts, cache_folder, cache_key)
+  #the parameter tensor is shared by every simulation, so it is read-only like the survival cohorts
+  calibration_artifacts['parameter_tensor'].flags.writeable = False
+  calibration_artifacts['function_parameters'] = make_parameter_dict(calibration_artifacts['parameter_tensor'], admission_type_list, mdc_list)
+
+  return calibration_artifacts
+
+def get_admissions_standards(prob_type_list, machine_type_list, data_folder = 'oxygen_use_data'):
   #this function reads the probability of an admitted patient using a given oxygen machine as a function of time since admission
-  scenario_lists = {}
-  integrated_probability_dict = {}
+  #each cohort is a semi-random sample of the probabilities as a function of time, and the cohorts for each oxygen machine (mt) and
+  #probability source (pt) are stored as one (cohort x days since admission) array - survival_cohorts[mt + pt] - so row n is cohort n
+  survival_cohorts = {}
   for mt in machine_type_list:#calculate probabilities for different oxygen machines
-    integrated_probability_dict[mt] = {}
     for pt_cnt, pt in enumerate(prob_type_list):#calculate probabilities using either unc or mt sinai data (mt. sinai data has 'high' and 'low' estimations
-      if pt_cnt == 0:
-        if mt == 'icu' or mt == 'vents':
-          survival_probs = pd.read_csv('oxygen_use_data/' + mt + '_probs_unc.csv', index_col = 0)
-        else:
-          survival_probs = pd.read_csv('oxygen_use_data/' + mt + pt + '.csv', index_col = 0)
+      if pt_cnt == 0 and (mt == 'icu' or mt == 'vents'):
+        survival_probs = pd.read_csv(data_folder + '/' + mt + '_probs_unc.csv', index_col = 0)
       else:           
-        survival_probs = pd.read_csv('oxygen_use_data/' + mt + pt + '.csv', index_col = 0)
-      scenario_lists[mt + pt] = []
-      counter = 0
-      for x in survival_probs:# this loops through the different 'cohorts' - individual probabilities calculated for different cohorts (so the probabilities as a function of time are a semi-random variable)
-        #each scnenario is 'named' and then the list of names are also saved
-        if pt_cnt == 0:
-          integrated_probability_dict[mt][x] = survival_probs[x]
-          scenario_lists[mt + pt].append(x)
-        else:
-          integrated_probability_dict[mt][str(counter) + '_level_' + str(pt_cnt)] = survival_probs[x]
-          scenario_lists[mt + pt].append(str(counter) + '_level_' + str(pt_cnt))
-        counter += 1
-  return scenario_lists, integrated_probability_dict
+        survival_probs = pd.read_csv(data_folder + '/' + mt + pt + '.csv', index_col = 0)
+      survival_cohorts[mt + pt] = np.ascontiguousarray(survival_probs.to_numpy(dtype = float).T)
+      #the arrays are shared by the census calculations (and by forked worker processes), so they are read-only
+      survival_cohorts[mt + pt].flags.writeable = False
+  return survival_cohorts
 
 
-def calculate_oxygen_usage(hospitalizations, flow_lookahead, machine_survival_probabilities, scenario_lists, machine_type_list, probability_type):
+def make_oxygen_transfer_matrix(synthetic_length, flow_lookahead, survival_cohorts, machine_type_list, probability_type):
+  #this function makes a matrix for each oxygen type that translates a daily admissions timeseries into a daily census timeseries
+  #each day's admissions follow the survival probabilities of one cohort, with the cohorts used in turn
+  #(one step per day and oxygen machine type, so all machine types share the same cohort counter)
+  #column d of the matrix holds the survival probabilities of the cohort used on day d, starting in row d
+  admission_days = np.arange(synthetic_length)
+  census_rows = admission_days[:,None] + np.arange(flow_lookahead)[None,:]
+  transfer_matrix = {}
+  #different oxygen types - room air, 02, icu, vents
+  for mt_cnt, mt in enumerate(machine_type_list):
+    cohort_probs = survival_cohorts[mt + probability_type][:,:flow_lookahead]
+    day_cohorts = (admission_days * len(machine_type_list) + mt_cnt) % cohort_probs.shape[0]
+    transfer_matrix[mt] = np.zeros((synthetic_length + flow_lookahead, synthetic_length))
+    transfer_matrix[mt][census_rows, admission_days[:,None]] = cohort_probs[day_cohorts,:]
+    
+  return transfer_matrix
+
+def calculate_oxygen_usage(hospitalizations, flow_lookahead, survival_cohorts, machine_type_list, probability_type):
   #this function takes the oxygen usage estimations from patient flow data
   #and estimates the patients on each oxygen types based on a hosptial admissions timeseries (either historical or synthetic)
-  synthetic_length = len(hospitalizations)
+  #hospitalizations can be a single timeseries or a matrix of timeseries (days x realizations), in which case 
+  #the census of each oxygen type is returned for every realization ((days + flow_lookahead) x realizations)
+  hospitalizations = np.asarray(hospitalizations, dtype = float)
+  transfer_matrix = make_oxygen_transfer_matrix(hospitalizations.shape[0], flow_lookahead, survival_cohorts, machine_type_list, probability_type)
   oxygen_usage = {}
-  #different oxygen types - room air, 02, icu, vents
   for mt in machine_type_list:
-    oxygen_usage[mt] = np.zeros(synthetic_length + flow_lookahead)
-  #for each daily admission total, calculate the % of those patients on each oxygen device
-  flow_count = 0
-  for day_count in range(0, synthetic_length):
-    for mt in machine_type_list:
-      #randomly select a cohort for their survial probabilities on each oxygen type
-      realization_list = scenario_lists[mt + probability_type]
-      flow_rlz = realization_list[flow_count]
-      flow_count += 1
-      if flow_count == len(realization_list):
-        flow_count = 0
-      machine_probs = machine_survival_probabilities[mt][flow_rlz]
-      #add the estimates of future oxygen device usage from today's admissions to the estimate from previous days admissiosn to get a hospital census estimate
-      for future_day in range(0, flow_lookahead):
-        oxygen_usage[mt][day_count + future_day] += machine_probs.loc[future_day] * hospitalizations[day_count]
+    #add the estimates of future oxygen device usage from each day's admissions to get a hospital census estimate
+    oxygen_usage[mt] = transfer_matrix[mt] @ hospitalizations
     
   total_beds = np.asarray(oxygen_usage['room_air'] + oxygen_usage['o2'])
   total_icu = np.asarray(oxygen_usage['icu'])
@@ -708,9 +1147,59 @@ def calculate_oxygen_usage(hospitalizations, flow_lookahead, machine_survival_pr
 
   return total_beds, total_icu, total_vents  
   
+def calculate_ensemble_oxygen_usage(hospitalization_ensemble, flow_lookahead, survival_cohorts, machine_type_list, probability_type, gradations = 7):
+  #this function projects the oxygen type usage for every realization of a synthetic admissions ensemble (days x realizations)
+  #and then finds the distribution percentiles of the projected census (the percentiles of the census are not the census of the admission percentiles)
+  ensemble_beds, ensemble_icu, ensemble_vents = calculate_oxygen_usage(hospitalization_ensemble, flow_lookahead, survival_cohorts, machine_type_list, probability_type)
+  census_length, num_realizations = ensemble_icu.shape
+  beds_percentiles = discritize_distribution(ensemble_beds, census_length, num_realizations, gradations)
+  icu_percentiles = discritize_distribution(ensemble_icu, census_length, num_realizations, gradations)
+  vents_percentiles = discritize_distribution(ensemble_vents, census_length, num_realizations, gradations)
+  
+  return beds_percentiles, icu_percentiles, vents_percentiles
 
-def calibrate_icu_census(total_census_project, admission_type_series, start_value, calibration_start, calibration_end, admission_type_list, mdc_list):  
+def make_census_stream(flow_lookahead, survival_cohorts, machine_type_list, probability_type):
+  #this function initializes a census estimate that is updated one day of admissions at a time (see push_census_stream)
+  #for each oxygen type, pending_census is a ring buffer with the census from all previous admissions over the next flow_lookahead days
+  census_stream = {}
+  census_stream['flow_lookahead'] = flow_lookahead
+  census_stream['machine_type_list'] = machine_type_list
+  census_stream['current_day'] = 0
+  census_stream['buffer_start'] = 0
+  census_stream['cohort_probs'] = {}
+  census_stream['pending_census'] = {}
+  for mt in machine_type_list:
+    census_stream['cohort_probs'][mt] = survival_cohorts[mt + probability_type][:,:flow_lookahead]
+    census_stream['pending_census'][mt] = np.zeros(flow_lookahead)
+    
+  return census_stream
+
+def push_census_stream(census_stream, admissions_today):
+  #this function adds one day of admissions to the census estimate and returns the census projection for the next flow_lookahead days 
+  #(starting with today) of each oxygen type - cohorts are assigned to each day in the same order as calculate_oxygen_usage
+  flow_lookahead = census_stream['flow_lookahead']
+  machine_type_list = census_stream['machine_type_list']
+  buffer_index = (census_stream['buffer_start'] + np.arange(flow_lookahead)) % flow_lookahead
+  census_projection = {}
+  for mt_cnt, mt in enumerate(machine_type_list):
+    cohort_probs = census_stream['cohort_probs'][mt]
+    cohort_num = (census_stream['current_day'] * len(machine_type_list) + mt_cnt) % cohort_probs.shape[0]
+    census_stream['pending_census'][mt][buffer_index] += admissions_today * cohort_probs[cohort_num,:]
+    census_projection[mt] = census_stream['pending_census'][mt][buffer_index]
+    #today's census is complete, so the buffer position is reused for the last day of the lookahead
+    census_stream['pending_census'][mt][census_stream['buffer_start']] = 0.0
+  census_stream['buffer_start'] = (census_stream['buffer_start'] + 1) % flow_lookahead
+  census_stream['current_day'] += 1
+  
+  total_beds = census_projection['room_air'] + census_projection['o2']
+  total_icu = census_projection['icu']
+  total_vents = census_projection['vents']
 
+  return total_beds, total_icu, total_vents
+
+def fill_covid_icu_census(total_census_project):
+  #this function fills in covid icu census data (in place) for the days before covid icu census data was kept,
+  #assuming linear growth from the first day with icu census data to the first day with covid icu census data
   #loop through hospital census data from unc-only hospital system, and the entire study are hospital system
   total_zeros = True
   covid_zeros = True
@@ -735,6 +1224,13 @@ def calibrate_icu_census(total_census_project, admission_type_series, start_valu
         av_slope = av_slope * 0.0
       covid_zeros = False
 
+  return total_census_project
+
+def calibrate_icu_census(total_census_project, admission_type_series, start_value, calibration_start, calibration_end, admission_type_list, mdc_list):  
+
+  #fill in covid icu census data from before daily covid census data was kept
+  fill_covid_icu_census(total_census_project)
+
   #find non-covid icu patients (after no-data backfill)   
   non_covid_hospital_project = total_census_project['total_icu_census'] - total_census_project['covid_icu_census']
   
@@ -773,13 +1269,145 @@ def calibrate_icu_census(total_census_project, admission_type_series, start_valu
   return constants
 
   
-def make_synthetic_series(total_admissions, days_extended, days_cutoff, calibration_start_date, timeseries_start_date, timeseries_end_date, total_pop, start_simulation, total_synthetic_length):
+def make_synthetic_series(total_admissions, days_extended, days_cutoff, calibration_start_date, timeseries_start_date, timeseries_end_date, total_pop, start_simulation, total_synthetic_length, num_realizations = 100, block_size = None, sketch_capacity = 10000, ensemble_folder = None, ensemble_seed = 11, num_workers = 1, projected_growth_rate = 0.8, calibrated_growth_rate = 0.0126, hosp_rate_min = 0.015, hosp_rate_range = 0.01, keep_realizations = True):
   #parameters for the SEIR simulations
-  calibrated_growth_rate = 0.0126#growth rate used to 'fill-in' early timeseries record w/o data
-  projected_growth_rate = 0.8#r_eff to use for 'falling covid' portion of simulated record
+  #calibrated_growth_rate - growth rate used to 'fill-in' early timeseries record w/o data
+  #projected_growth_rate - r_eff to use for 'falling covid' portion of simulated record
+  #hosp_rate_min, hosp_rate_range - the rate of infections that become hospitalized is drawn from hosp_rate_min to hosp_rate_min + hosp_rate_range for each realization
+  #block_size - number of realizations simulated at once, when the ensemble is made in more than one block the realizations (seir_model) are only kept if they
+  #are written to ensemble_folder - multi-block runs without a folder raise a ValueError unless keep_realizations = False, in which case seir_model is None and only the percentiles are returned
+  if block_size is None:
+    block_size = num_realizations
+  if block_size < num_realizations and ensemble_folder is None and keep_realizations:
+    raise ValueError('make_synthetic_series: the realizations of a multi-block ensemble (block_size = ' + str(block_size) + ' < num_realizations = ' + str(num_realizations) + ') are only kept in an ensemble_folder - set ensemble_folder, or keep_realizations = False to return only the percentiles')
   calibration_start = calibration_start_date.timetuple().tm_yday - timeseries_start_date.timetuple().tm_yday + (calibration_start_date.year - timeseries_start_date.year) * 365
-  num_realizations = 100
+  backfill_admissions(total_admissions, calibration_start, calibrated_growth_rate, ensemble_seed)
+  #the inversion of the observed admissions is shared by every realization in a block (see make_seihr_inversion_table)
+  inversion_table = make_seihr_inversion_table(total_admissions, timeseries_start_date, timeseries_end_date)
   
+  gradations = 7
+  seir_percentile_components = ['ma_reff', 'h', 'e', 'i', 's']
+  #the ensemble is simulated in blocks of realizations, and each block is added to a mergeable summary of the distribution (quantile sketch) of each seir component
+  #so memory use depends on the block size and sketch capacity, not on the number of realizations
+  quantile_sketches = {}
+  for seir_component in seir_percentile_components:
+    quantile_sketches[seir_component] = make_quantile_sketch(total_synthetic_length, sketch_capacity)
+  #seir_model has the (total_synthetic_length x num_realizations) values of each seir component - when the ensemble is made in one block the simulated values are returned,
+  #when there are multiple blocks the values are written to memory-mapped .npy files in ensemble_folder (or not kept if no folder is given and keep_realizations = False)
+  seir_model = None
+  if ensemble_folder is not None:
+    if not os.path.isdir(ensemble_folder):
+      os.makedirs(ensemble_folder)
+    seir_model = {}
+    for seir_component in ['s', 'e', 'i', 'r_eff', 'h', 'ma_reff']:
+      seir_model[seir_component] = np.lib.format.open_memmap(ensemble_folder + '/' + seir_component + '.npy', mode = 'w+', shape = (total_synthetic_length, num_realizations))
+  #each realization draws from its own random stream, so blocks can be simulated in seperate worker processes and give the same values
+  block_list = []
+  for block_start in range(0, num_realizations, block_size):
+    block_list.append((total_admissions, days_extended, days_cutoff, inversion_table, total_pop, start_simulation, total_synthetic_length, np.arange(block_start, min(block_start + block_size, num_realizations)), projected_growth_rate, ensemble_seed, hosp_rate_min, hosp_rate_range))
+  if num_workers > 1:
+    executor = ProcessPoolExecutor(max_workers = num_workers, mp_context = get_calibration_context())
+    block_results = executor.map(simulate_seihr_block, *zip(*block_list))
+  else:
+    executor = None
+    block_results = map(simulate_seihr_block, *zip(*block_list))
+  for block_start, block_model in zip(range(0, num_realizations, block_size), block_results):
+    block_realizations = block_model['s'].shape[1]
+    for seir_component in seir_percentile_components:
+      update_quantile_sketch(quantile_sketches[seir_component], block_model[seir_component])
+    if ensemble_folder is not None:
+      for seir_component in block_model:
+        seir_model[seir_component][:,block_start:(block_start + block_realizations)] = block_model[seir_component]
+    elif block_realizations == num_realizations:
+      seir_model = block_model
+  if executor is not None:
+    executor.shutdown()
+  if ensemble_folder is not None:
+    for seir_component in seir_model:
+      seir_model[seir_component].flush()
+
+  seir_percentiles = {}
+  for seir_component in seir_percentile_components:
+    #translate the quantile sketches into dictionary with the values at distribution percentiles (gradations x total_synthetic_length)
+    #(these are the same values as discritize_distribution until a sketch holds more than sketch_capacity realizations)
+    seir_percentiles[seir_component] = get_sketch_percentiles(quantile_sketches[seir_component], gradations)
+  date_index = []
+  for t in range(0, total_synthetic_length):
+    current_value = timeseries_start_date + timedelta(t)
+    date_index.append(current_value)
+
+  return seir_percentiles, date_index, seir_model
+
+def make_scenario_grid(scenario_parameters):
+  #this function makes a list of scenarios for make_scenario_sweep from every combination of the values in scenario_parameters (dictionary of lists of values for each parameter)
+  scenario_list = [{}]
+  for parameter_name in scenario_parameters:
+    scenario_list = [dict(x, **{parameter_name: y}) for x in scenario_list for y in scenario_parameters[parameter_name]]
+  return scenario_list
+
+def make_scenario_sweep(total_admissions, scenario_list, days_cutoff, calibration_start_date, timeseries_start_date, timeseries_end_date, total_pop, start_simulation, total_synthetic_length, num_realizations = 100, ensemble_seed = 11, quantile_list = None):
+  #this function simulates the seihr model ensemble for every scenario in scenario_list - each scenario is a dictionary with values for any of 
+  #days_extended, projected_growth_rate, calibrated_growth_rate, hosp_rate_min, and hosp_rate_range (parameters that are not given use the make_synthetic_series defaults)
+  #scenarios with the same back-fill and hospitalization rates (calibrated_growth_rate, hosp_rate_min, hosp_rate_range) share a single inversion of the observed data,
+  #and all of their projections are simulated together
+  #returns a dictionary with an array (scenario x quantile x day) for each seir component, and the scenario and quantile lists that index the arrays
+  #(total_admissions is not changed, each scenario is back-filled from a copy)
+  if quantile_list is None:
+    quantile_list = [0.025, 0.5, 0.975]
+  default_parameters = {'days_extended': 10, 'projected_growth_rate': 0.8, 'calibrated_growth_rate': 0.0126, 'hosp_rate_min': 0.015, 'hosp_rate_range': 0.01}
+  sweep_parameters = []
+  for scenario_values in scenario_list:
+    sweep_parameters.append(dict(default_parameters, **scenario_values))
+  calibration_start = calibration_start_date.timetuple().tm_yday - timeseries_start_date.timetuple().tm_yday + (calibration_start_date.year - timeseries_start_date.year) * 365
+  last_day_used = start_simulation - days_cutoff
+  realization_index = np.arange(num_realizations)
+  seir_percentile_components = ['ma_reff', 'h', 'e', 'i', 's']
+  sweep_results = {}
+  for seir_component in seir_percentile_components:
+    sweep_results[seir_component] = np.zeros((len(sweep_parameters), len(quantile_list), total_synthetic_length))
+  #group the scenarios that use the same observed data inversion
+  #(the back-filled admissions, and so the inversion table, only depend on calibrated_growth_rate, so groups with the same rate share a table)
+  inversion_tables = {}
+  inversion_groups = {}
+  for scenario_num, scenario_values in enumerate(sweep_parameters):
+    inversion_key = (scenario_values['calibrated_growth_rate'], scenario_values['hosp_rate_min'], scenario_values['hosp_rate_range'])
+    if inversion_key not in inversion_groups:
+      inversion_groups[inversion_key] = []
+    inversion_groups[inversion_key].append(scenario_num)
+  for inversion_key in inversion_groups:
+    calibrated_growth_rate, hosp_rate_min, hosp_rate_range = inversion_key
+    scenario_admissions = np.array(total_admissions, dtype = float)
+    backfill_admissions(scenario_admissions, calibration_start, calibrated_growth_rate, ensemble_seed)
+    if calibrated_growth_rate not in inversion_tables:
+      inversion_tables[calibrated_growth_rate] = make_seihr_inversion_table(scenario_admissions, timeseries_start_date, timeseries_end_date)
+    seihr_parameters = draw_seihr_parameters(len(scenario_admissions), total_synthetic_length, realization_index, ensemble_seed, hosp_rate_min, hosp_rate_range)
+    observed_seihr = invert_observed_seihr(scenario_admissions, seihr_parameters, inversion_tables[calibrated_growth_rate], total_pop)
+    #the realizations of every scenario in the group are projected together (scenario x realization columns)
+    group_scenarios = inversion_groups[inversion_key]
+    group_parameters = {}
+    for parameter_name in seihr_parameters:
+      group_parameters[parameter_name] = np.concatenate([seihr_parameters[parameter_name]] * len(group_scenarios), axis = 0)
+    group_observed = {}
+    for component in observed_seihr:
+      if component == 'h_res':
+        group_observed[component] = observed_seihr[component]
+      else:
+        group_observed[component] = np.concatenate([observed_seihr[component]] * len(group_scenarios), axis = 0)
+    begin_reduction_day = np.repeat([last_day_used + sweep_parameters[x]['days_extended'] for x in group_scenarios], num_realizations)
+    projected_growth_rate = np.repeat([sweep_parameters[x]['projected_growth_rate'] for x in group_scenarios], num_realizations)
+    group_model = project_seihr(scenario_admissions, group_parameters, group_observed, last_day_used, begin_reduction_day, projected_growth_rate, total_pop, total_synthetic_length)
+    for group_num, scenario_num in enumerate(group_scenarios):
+      for seir_component in seir_percentile_components:
+        scenario_quantiles = calculate_distribution_quantiles(group_model[seir_component][:,(group_num * num_realizations):((group_num + 1) * num_realizations)], quantile_list)
+        for quantile_num, quantile_level in enumerate(quantile_list):
+          sweep_results[seir_component][scenario_num, quantile_num, :] = scenario_quantiles[str(quantile_level)]
+  sweep_results['scenario_list'] = sweep_parameters
+  sweep_results['quantile_list'] = quantile_list
+  
+  return sweep_results
+
+def backfill_admissions(total_admissions, calibration_start, calibrated_growth_rate, ensemble_seed):
+  #this function back-fills hospital admissions in the beginning of the timeseries (changing total_admissions) based on the observed growth rates when the data begins
   #get average new hospital admissions at the beginning of the calibration period (September 20 - December 26)
   #calibration period is used to calibrate SEIR model at the beginning of the simulation period
   initial_value = np.mean(total_admissions[calibration_start:(calibration_start+5)])
@@ -788,125 +1416,228 @@ def make_synthetic_series(total_admissions, days_extended, days_cutoff, calibrat
   error_list = np.zeros(20)
   for x in range(calibration_start, calibration_start + 20):
     error_list[x-calibration_start] = (total_admissions[x] - initial_value * np.power(1.0 + calibrated_growth_rate, x - calibration_start))/( initial_value * np.power(1.0 + calibrated_growth_rate, x - calibration_start) )
-  #back-fill hospital admissions in the beginning of the timeseries based on the observed growth rates when the data begins
+  #(the back-filled values are shared by all realizations, so they use their own random stream)
+  backfill_rng = make_realization_rngs(ensemble_seed, 0, [0])[0]
   empty_toggle = 0
-  empty_counter = 0
   for x in range(1, len(total_admissions)):
     if total_admissions[-1*x] == 0.0 and empty_toggle == 0:
       empty_toggle = 1
       start_value = np.mean(total_admissions[-1*(x-1):-1*(x-5)])
       estimated_value = start_value/(1 + calibrated_growth_rate)
-      error_term = np.random.randint(len(error_list))
+      error_term = backfill_rng.integers(len(error_list))
       total_admissions[-1*x] = estimated_value * (1.0 + error_list[error_term])
     elif total_admissions[-1*x] == 0.0:
       estimated_value = estimated_value / (1 + calibrated_growth_rate)
-      error_term = np.random.randint(len(error_list))
+      error_term = backfill_rng.integers(len(error_list))
       total_admissions[-1*x] = estimated_value * (1.0 + error_list[error_term])
-  
-  #initialize seir model realizations
-  seir_model = {}
-  seir_components = ['s', 'e', 'i', 'r_eff', 'h', 'ma_reff']
-  for component in seir_components:
-    seir_model[component] = np.zeros((total_synthetic_length, num_realizations))
-  #initial synthetic hospitalization value
+
+def simulate_seihr_block(total_admissions, days_extended, days_cutoff, inversion_table, total_pop, start_simulation, total_synthetic_length, realization_index, projected_growth_rate, ensemble_seed, hosp_rate_min = 0.015, hosp_rate_range = 0.01):
+  #this function simulates a block of seihr model realizations (realization_index is the number of each realization in the ensemble), 
+  #returning a dictionary with the (total_synthetic_length x block realizations) values of each seir component
+  #inversion_table is the observed admissions inversion from make_seihr_inversion_table
+  seihr_parameters = draw_seihr_parameters(len(total_admissions), total_synthetic_length, realization_index, ensemble_seed, hosp_rate_min, hosp_rate_range)
+  observed_seihr = invert_observed_seihr(total_admissions, seihr_parameters, inversion_table, total_pop)
   #last day of observed data
   last_day_used = start_simulation - days_cutoff
   #when does the reproductive number begin to drop?
   begin_reduction_day = last_day_used + days_extended
+  
+  return project_seihr(total_admissions, seihr_parameters, observed_seihr, last_day_used, begin_reduction_day, projected_growth_rate, total_pop, total_synthetic_length)
+  
+def draw_seihr_parameters(num_observations, total_synthetic_length, realization_index, ensemble_seed, hosp_rate_min, hosp_rate_range):
+  #this function draws the random seihr model parameters of each realization in realization_index
+  num_realizations = len(realization_index)
+  seihr_parameters = {}
   #values for randomization of realizations
-  ar_residual_counter = 186 + np.random.randint(len(total_admissions) - 200, size = (num_realizations, total_synthetic_length))
+  seihr_parameters['ar_residual_counter'] = np.zeros((num_realizations, total_synthetic_length), dtype = int)
+  #for each realization, we randomize seihr model parameters
+  seihr_parameters['days_of_infection'] = np.zeros(num_realizations, dtype = int)#how long is a person infectious
+  seihr_parameters['days_of_exposure'] = np.zeros(num_realizations, dtype = int)#how long does it take to become infectious after exposure
+  seihr_parameters['hosp_rate'] = np.zeros(num_realizations)#what is the rate of infections that become hospitalized
+  for realn, realization_rng in enumerate(make_realization_rngs(ensemble_seed, 1, realization_index)):
+    seihr_parameters['ar_residual_counter'][realn,:] = 186 + realization_rng.integers(num_observations - 200, size = total_synthetic_length)
+    seihr_parameters['days_of_infection'][realn] = realization_rng.integers(8,10)
+    seihr_parameters['days_of_exposure'][realn] = realization_rng.integers(2, 5)
+    seihr_parameters['hosp_rate'][realn] = hosp_rate_min + realization_rng.random() * hosp_rate_range
+    
+  return seihr_parameters
+
+def make_seihr_inversion_table(total_admissions, timeseries_start_date, timeseries_end_date):
+  #this function makes the table of observed hospitalizations inverted into seihr model variables, which is shared by all realizations of an admissions timeseries
+  #the variables are calculated with a hospitalization rate of 1 - they scale with 1/hosp_rate, so the values for any hospitalization rate are found in invert_observed_seihr
+  #(the table does not depend on the total population or hospitalization rate), and the values for each (days_of_infection, days_of_exposure) pair are added by add_seihr_inversion_pairs
+  inversion_table = {}
+  #last day before the cutoff, and days with inverted values
   timeseries_cutoff = timeseries_end_date - timedelta(10)
-  for realn in range(0, num_realizations):
-    #for each realization, we randomize seihr model parameters
-    days_of_infection = np.random.randint(8,10)#how long is a person infectious
-    days_of_exposure = np.random.randint(2, 5)#how long does it take to become infectious after exposure
-    hosp_rate = 0.015 + np.random.rand(1) * 0.01#what is the rate of infections that become hospitalized
+  inversion_table['last_day'] = min(len(total_admissions) - 1, (timeseries_cutoff - timeseries_start_date).days)
+  inversion_table['inverted_days'] = np.zeros(len(total_admissions), dtype = bool)
+  inversion_table['inverted_days'][1:(min(inversion_table['last_day'], len(total_admissions) - 8) + 1)] = True
+  inversion_table['h_res'] = np.zeros(len(total_admissions))
+  inversion_table['admissions_ma'] = np.ones(len(total_admissions))
+  for x in np.arange(len(total_admissions))[inversion_table['inverted_days']]:
+    inversion_table['admissions_ma'][x] = np.mean(total_admissions[x:(x+7)])
+    #we also calculate the residual between the 7-day moving average hospitalizations and the daily hospitalization rate
+    inversion_table['h_res'][x] = (total_admissions[x+7] - inversion_table['admissions_ma'][x])/inversion_table['admissions_ma'][x]
+  inversion_table['parameter_pairs'] = {}
+  
+  return inversion_table
+
+def add_seihr_inversion_pairs(inversion_table, parameter_pairs):
+  #this function adds the inverted seihr variables for each (days_of_infection, days_of_exposure) pair in parameter_pairs to inversion_table (make_seihr_inversion_table)
+  #pairs already in the table are not recalculated
+  for days_of_infection, days_of_exposure in parameter_pairs:
+    if (days_of_infection, days_of_exposure) in inversion_table['parameter_pairs']:
+      continue
+    pair_values = {}
+    for component in ['i', 'e', 'newly_exposed']:
+      pair_values[component] = np.zeros(len(inversion_table['admissions_ma']))
+    for x in np.arange(len(inversion_table['admissions_ma']))[inversion_table['inverted_days']]:
+      #the infectious population at a timestep is calculated from the 7-day moving average new hospitalizations, divided by the hospitalization rate, and multiplied by the number of days a person is infectious
+      pair_values['i'][x] = max(inversion_table['admissions_ma'][x] * days_of_infection, 0.0)
+      #the newly exposed population is equal to the change in infectious population, PLUS the population of infectious people who have recovered, and the total exposed population is the newly exposed time the average days of exposure
+      pair_values['e'][x] = (pair_values['i'][x] - pair_values['i'][x-1] + pair_values['i'][x-1]/days_of_infection) * days_of_exposure
+      #the 'newly' exposed population (change in exposed population plus the number of exposed > infected) is removed from the susceptible population
+      pair_values['newly_exposed'][x] = pair_values['e'][x] - pair_values['e'][x-1] + pair_values['e'][x-1]/days_of_exposure
+    pair_values['cumulative_exposed'] = np.cumsum(pair_values['newly_exposed'])
+    inversion_table['parameter_pairs'][(days_of_infection, days_of_exposure)] = pair_values
     
-    #estimation of model parameters during observed timeperiod
-    seir_timeseries = {}
-    for component in ['s', 'e', 'i', 'r_eff', 'h_res', 'ma_eff']:
-      seir_timeseries[component] = np.zeros(len(total_admissions))
-    seir_timeseries['s'][0:7] = np.ones(7)*total_pop
-    residuals_ma = np.zeros(len(total_admissions) - 14)
-    #find SEIR variables from observed hospitalizations
-    for x in range(1, len(total_admissions)):
-      if timeseries_start_date + timedelta(x) > timeseries_cutoff:
-        break
-      if x < len(total_admissions) - 7:
-        #the infectious population at a timestep is calculated from the 7-day moving average new hospitalizations, divided by the hospitalization rate, and multiplied by the number of days a person is infectious
-        seir_timeseries['i'][x] = max(np.mean(total_admissions[x:(x+7)]) * days_of_infection/ hosp_rate, 0.0)
-        #the newly exposed population is equal to the change in infectious population, PLUS the population of infectious people who have recovered, and the total exposed population is the newly exposed time the average days of exposure
-        seir_timeseries['e'][x] = (seir_timeseries['i'][x] - seir_timeseries['i'][x-1] + seir_timeseries['i'][x - 1]/days_of_infection) * days_of_exposure
-        #the susceptible population is equal to the old susceptible population, minum the 'newly' exposed population (change in exposed population plus the number of exposed > infected)
-        seir_timeseries['s'][x] = seir_timeseries['s'][x-1] - (seir_timeseries['e'][x] - seir_timeseries['e'][x-1] + seir_timeseries['e'][x - 1]/days_of_exposure)
-        #the r_eff value is calculated using the s, e, and i populations
-        seir_timeseries['r_eff'][x] = max(days_of_infection * (seir_timeseries['e'][x] - seir_timeseries['e'][x-1] + seir_timeseries['e'][x - 1]/days_of_exposure) * total_pop / (seir_timeseries['s'][x] * seir_timeseries['i'][x]), 0.0)        
-        #we also calculate the residual between the 7-day moving average hospitalizations and the daily hospitalization rate
-        seir_timeseries['h_res'][x] = (total_admissions[x+7] - np.mean(total_admissions[x:(x+7)]))/np.mean(total_admissions[x:(x+7)])
-      if x >= 14:
-        #smooth out estimation of r_eff with the moving average, find residuals between MA and estimated value
-        seir_timeseries['ma_eff'][x] = np.mean(seir_timeseries['r_eff'][(x-14):x])
-        residuals_ma[x-14] = seir_timeseries['r_eff'][x] - seir_timeseries['ma_eff'][x]
-    #use an autoregressive model to simulate daily r_eff for the simulated future
-    ar_length = 2
-    ar_estimates2, ar_residuals2, ar_coef2 = make_ar_model(ar_length, residuals_ma)
-    ar_term1 = np.zeros(total_synthetic_length)
+  return inversion_table
+
+def invert_observed_seihr(total_admissions, seihr_parameters, inversion_table, total_pop):
+  #this function estimates the seihr model variables during the observed timeperiod from observed hospitalizations, for all realizations at once (realizations x days),
+  #and fits the autoregressive model of r_eff residuals for each realization
+  #the inversion only depends on days_of_infection and days_of_exposure (scaled by 1/hosp_rate), so it is looked up from inversion_table (make_seihr_inversion_table),
+  #and the parameter pairs that are not in the table yet are added to it
+  days_of_infection = seihr_parameters['days_of_infection']
+  days_of_exposure = seihr_parameters['days_of_exposure']
+  hosp_rate = seihr_parameters['hosp_rate']
+  num_realizations = len(hosp_rate)
+  realization_pairs = list(zip(days_of_infection.tolist(), days_of_exposure.tolist()))
+  add_seihr_inversion_pairs(inversion_table, sorted(set(realization_pairs)))
+  inverted_days = inversion_table['inverted_days']
+  last_day = inversion_table['last_day']
+  seir_timeseries = {}
+  seir_timeseries['h_res'] = inversion_table['h_res']
+  #look up the inverted values of each realization's parameter pair and scale them by the hospitalization rate
+  unique_pairs = sorted(set(realization_pairs))
+  pair_rows = {}
+  for pair_num, parameter_pair in enumerate(unique_pairs):
+    pair_rows[parameter_pair] = pair_num
+  realization_rows = np.array([pair_rows[x] for x in realization_pairs], dtype = int)
+  hosp_scale = hosp_rate[:,None]
+  for component in ['i', 'e', 'newly_exposed', 'cumulative_exposed']:
+    pair_values = np.vstack([inversion_table['parameter_pairs'][x][component] for x in unique_pairs])
+    seir_timeseries[component] = pair_values[realization_rows,:] / hosp_scale
+  #the susceptible population is equal to the initial population, minus all of the newly exposed population
+  seir_timeseries['s'] = np.zeros((num_realizations, len(total_admissions)))
+  seir_timeseries['s'][:,0:7] = total_pop
+  seir_timeseries['s'][:,inverted_days] = total_pop - seir_timeseries['cumulative_exposed'][:,inverted_days]
+  #the r_eff value is calculated using the s, e, and i populations
+  seir_timeseries['r_eff'] = np.zeros((num_realizations, len(total_admissions)))
+  seir_timeseries['r_eff'][:,inverted_days] = np.maximum(days_of_infection[:,None] * seir_timeseries['newly_exposed'][:,inverted_days] * total_pop / (seir_timeseries['s'][:,inverted_days] * seir_timeseries['i'][:,inverted_days]), 0.0)
+  del seir_timeseries['newly_exposed'], seir_timeseries['cumulative_exposed']
+  #smooth out estimation of r_eff with the moving average, find residuals between MA and estimated value
+  seir_timeseries['ma_eff'] = np.zeros((num_realizations, len(total_admissions)))
+  residuals_ma = np.zeros((num_realizations, len(total_admissions) - 14))
+  if last_day >= 14:
+    seir_timeseries['ma_eff'][:,14:(last_day + 1)] = np.mean(sliding_window_view(seir_timeseries['r_eff'], 14, axis = 1)[:,:(last_day - 13),:], axis = 2)
+    residuals_ma[:,:(last_day - 13)] = seir_timeseries['r_eff'][:,14:(last_day + 1)] - seir_timeseries['ma_eff'][:,14:(last_day + 1)]
+  #use an autoregressive model to simulate daily r_eff for the simulated future
+  #(models are fit for all realizations at once - they depend on hosp_rate and total_pop, so they are not saved with the inversion table)
+  ar_length = 2
+  ar_estimates2, seir_timeseries['ar_residuals'], seir_timeseries['ar_coef'] = fit_ar_models(ar_length, residuals_ma)
+  
+  return seir_timeseries
+
+def project_seihr(total_admissions, seihr_parameters, seir_timeseries, last_day_used, begin_reduction_day, projected_growth_rate, total_pop, total_synthetic_length):
+  #this function simulates the seihr model from the observed estimates (invert_observed_seihr) through the end of the synthetic timeseries
+  #begin_reduction_day and projected_growth_rate can be a single value or one value for each realization (so multiple scenarios can be projected together)
+  #returns a dictionary with the (total_synthetic_length x realizations) values of each seir component
+  days_of_infection = seihr_parameters['days_of_infection']
+  days_of_exposure = seihr_parameters['days_of_exposure']
+  hosp_rate = seihr_parameters['hosp_rate']
+  ar_residual_counter = seihr_parameters['ar_residual_counter']
+  ar_residuals2 = seir_timeseries['ar_residuals']
+  ar_coef2 = seir_timeseries['ar_coef']
+  num_realizations = len(hosp_rate)
+  #initialize seir model realizations
+  seir_model = {}
+  seir_components = ['s', 'e', 'i', 'r_eff', 'h', 'ma_reff']
+  for component in seir_components:
+    seir_model[component] = np.zeros((total_synthetic_length, num_realizations))
+  ar_term1 = np.zeros((total_synthetic_length, num_realizations))
     
-    #get average initial reff from the end of observed data
-    starting_r = np.mean(seir_timeseries['ma_eff'][(last_day_used-40):last_day_used-20])
-    ending_r = projected_growth_rate * 1.0
-    seir_model_components = ['s', 'e', 'i', 'r_eff']
-    for x in range(0, total_synthetic_length):
-      random_error_term = ar_residual_counter[realn, x]
-      if x < last_day_used:
-        for smc in seir_model_components:
-          #the beginning of the model is based on observations for s/e/i/h
-          seir_model[smc][x, realn] = seir_timeseries[smc][x] * 1.0
-        #hospitalizations use 7-day moving average
-        if x > 0:
-          seir_model['h'][x, realn] = np.mean(total_admissions[max(x-7, 0):x])
-        if x > 6:
-          #we want to use an autoregressive model to simluate this term to apply to the synthetic series
-          #(i.e., the seihr model gives us the moving average value and we want the actual value)
-          ar_term1[x] = seir_timeseries['r_eff'][x] - seir_timeseries['ma_eff'][x]
-      else:
-        if x < len(total_admissions) - 10:
-          ar_term1[x] = seir_timeseries['r_eff'][x] - seir_timeseries['ma_eff'][x]
-        else:
-          #calculate residual between r_eff and its 7-day moving average with this function
-          ar_term1[x] = ar_term1[x-1] * ar_coef2[0] +ar_term1[x-2] * ar_coef2[1] + ar_residuals2[x - len(total_admissions) + 10]
-        #begin_reduction_day is the timestep at which r_eff starts to decline from its observed value
-        if x < begin_reduction_day:
-          seir_model['r_eff'][x, realn] = max(ar_term1[x] + starting_r, 0.0)
-        else:
-          #decline in r_eff happens over a 10-day period
-          seir_model['r_eff'][x, realn] = max(ar_term1[x] + ending_r + (starting_r - ending_r) * max(0.0, 1.0 - float(x - begin_reduction_day)/10), 0.0)
-        #calculate simulated seir values
-        if x > 0:
-          seir_model['e'][x, realn] = seir_model['e'][x-1, realn] - seir_model['e'][x-1, realn]/days_of_exposure + seir_model['r_eff'][x, realn] * seir_model['i'][x-1, realn] * seir_model['s'][x-1, realn]/(total_pop * days_of_infection)
-          seir_model['s'][x, realn] = seir_model['s'][x-1, realn] - seir_model['r_eff'][x, realn] * seir_model['i'][x-1, realn] * seir_model['s'][x-1, realn]/(total_pop * days_of_infection)
-          seir_model['i'][x, realn] =  seir_model['i'][x-1, realn] + seir_model['e'][x-1, realn]/days_of_exposure - seir_model['i'][x-1, realn]/days_of_infection
-        mean_admit = seir_model['i'][x, realn] * hosp_rate / days_of_infection
-        seir_model['h'][x, realn] = (1.0 +  seir_timeseries['h_res'][random_error_term]) * mean_admit
-        
-    for x in range(0, total_synthetic_length):
-      if x > 14:
-        seir_model['ma_reff'][x, realn] = np.mean(seir_model['r_eff'][(x-14):x, realn])
+  #get average initial reff from the end of observed data
+  starting_r = np.mean(seir_timeseries['ma_eff'][:,(last_day_used-40):last_day_used-20], axis = 1)
+  ending_r = projected_growth_rate * 1.0
+  seir_model_components = ['s', 'e', 'i', 'r_eff']
+  #each day of the simulation is calculated for all realizations at once
+  for x in range(0, total_synthetic_length):
+    random_error_term = ar_residual_counter[:,x]
+    if x < last_day_used:
+      for smc in seir_model_components:
+        #the beginning of the model is based on observations for s/e/i/h
+        seir_model[smc][x,:] = seir_timeseries[smc][:,x] * 1.0
+      #hospitalizations use 7-day moving average
+      if x > 0:
+        seir_model['h'][x,:] = np.mean(total_admissions[max(x-7, 0):x])
+      if x > 6:
+        #we want to use an autoregressive model to simluate this term to apply to the synthetic series
+        #(i.e., the seihr model gives us the moving average value and we want the actual value)
+        ar_term1[x,:] = seir_timeseries['r_eff'][:,x] - seir_timeseries['ma_eff'][:,x]
+    else:
+      if x < len(total_admissions) - 10:
+        ar_term1[x,:] = seir_timeseries['r_eff'][:,x] - seir_timeseries['ma_eff'][:,x]
       else:
-        seir_model['ma_reff'][x, realn] = np.mean(seir_model['r_eff'][:(x+1), realn])
-
-  gradations = 7
-  seir_percentiles = {}
-  for seir_component in ['ma_reff', 'h', 'e', 'i', 's']:
-    #translate seir from numpy array (total_synthetic_length x num_realizations) into dictionary with the values at distribution percentiles (gradations x total_synthetic_length)
-    seir_percentiles[seir_component] = discritize_distribution(seir_model[seir_component], total_synthetic_length, num_realizations, gradations)
-  date_index = []
-  for t in range(0, total_synthetic_length):
-    current_value = timeseries_start_date + timedelta(t)
-    date_index.append(current_value)
+        #calculate residual between r_eff and its 7-day moving average with this function
+        ar_term1[x,:] = ar_term1[x-1,:] * ar_coef2[:,0] + ar_term1[x-2,:] * ar_coef2[:,1] + ar_residuals2[:,x - len(total_admissions) + 10]
+      #begin_reduction_day is the timestep at which r_eff starts to decline from its observed value
+      #decline in r_eff happens over a 10-day period
+      reduction_ramp = np.maximum(0.0, 1.0 - (x - begin_reduction_day)/10)
+      seir_model['r_eff'][x,:] = np.where(x < begin_reduction_day, np.maximum(ar_term1[x,:] + starting_r, 0.0), np.maximum(ar_term1[x,:] + ending_r + (starting_r - ending_r) * reduction_ramp, 0.0))
+      #calculate simulated seir values
+      if x > 0:
+        seir_model['e'][x,:] = seir_model['e'][x-1,:] - seir_model['e'][x-1,:]/days_of_exposure + seir_model['r_eff'][x,:] * seir_model['i'][x-1,:] * seir_model['s'][x-1,:]/(total_pop * days_of_infection)
+        seir_model['s'][x,:] = seir_model['s'][x-1,:] - seir_model['r_eff'][x,:] * seir_model['i'][x-1,:] * seir_model['s'][x-1,:]/(total_pop * days_of_infection)
+        seir_model['i'][x,:] =  seir_model['i'][x-1,:] + seir_model['e'][x-1,:]/days_of_exposure - seir_model['i'][x-1,:]/days_of_infection
+      mean_admit = seir_model['i'][x,:] * hosp_rate / days_of_infection
+      seir_model['h'][x,:] = (1.0 +  seir_timeseries['h_res'][random_error_term]) * mean_admit
+      
+  #moving average of r_eff (over the previous 14 days, or all previous days at the start of the simulation)
+  r_eff_by_realization = np.ascontiguousarray(seir_model['r_eff'].T)
+  for x in range(0, min(total_synthetic_length, 15)):
+    seir_model['ma_reff'][x,:] = np.mean(r_eff_by_realization[:,:(x+1)], axis = 1)
+  if total_synthetic_length > 15:
+    seir_model['ma_reff'][15:,:] = np.mean(sliding_window_view(r_eff_by_realization, 14, axis = 1)[:,1:(total_synthetic_length - 14),:], axis = 2).T
 
-  return seir_percentiles, date_index
+  return seir_model
   
+def make_realization_rngs(ensemble_seed, stage_num, realization_index):
+  #this function makes a random number generator for each realization in realization_index, for one stochastic stage of the simulations
+  #generators are spawned from a SeedSequence with a (stage, realization) spawn key, so the random values of a realization don't depend
+  #on the order the realizations are simulated in, how they are split into blocks, or the number of worker processes
+  realization_rngs = []
+  for realization_num in realization_index:
+    realization_rngs.append(np.random.default_rng(np.random.SeedSequence(ensemble_seed, spawn_key = (stage_num, int(realization_num)))))
+  return realization_rngs
+
+def fit_ar_models(ar_length, error_lists):
+  #this function fits the same autoregressive model as make_ar_model to each row of error_lists (realizations x days) at once, 
+  #by solving the normal equations of each regression
+  independents = np.zeros((error_lists.shape[0], error_lists.shape[1] - ar_length, ar_length))
+  #lag the regression inputs
+  for x in range(0, ar_length):
+    independents[:,:,x] = error_lists[:,(ar_length - x - 1):(-1*(x+1))]
+  independents_t = np.transpose(independents, (0, 2, 1))
+  coef_ar = np.linalg.solve(np.matmul(independents_t, independents), np.matmul(independents_t, error_lists[:,ar_length:,None]))[:,:,0]
+  ar_estimate = np.zeros(error_lists.shape)
+  ar_residuals = np.zeros(error_lists.shape)
+  #estimate values with autoregressive function, calculate residuals
+  for y in range(0, ar_length):
+    ar_estimate[:,ar_length:] += coef_ar[:,y:(y+1)] * error_lists[:,(ar_length - y - 1):(-1*(y+1))]
+  ar_residuals[:,ar_length:] = error_lists[:,ar_length:] - ar_estimate[:,ar_length:]
+  return ar_estimate, ar_residuals, coef_ar
+
 def make_ar_model(ar_length, error_list):
   #this function calculates an autoregressive function for the timeseries 'error_list' with lag = ar_length
   dependent = error_list[ar_length:]
@@ -919,32 +1650,111 @@ def make_ar_model(ar_length, error_list):
   ar_estimate = np.zeros(len(error_list))
   ar_residuals = np.zeros(len(error_list))
   #estimate values with autoregressive function, calculate residuals
-  for x in range(ar_length, len(error_list)):
-    ar_estimate[x] = 0.0
-    for y in range(0, ar_length):
-      ar_estimate[x] += coef_ar[y] * error_list[x-y-1]
-    ar_residuals[x] = error_list[x] - ar_estimate[x]
+  for y in range(0, ar_length):
+    ar_estimate[ar_length:] += coef_ar[y] * error_list[(ar_length - y - 1):(-1*(y+1))]
+  ar_residuals[ar_length:] = error_list[ar_length:] - ar_estimate[ar_length:]
   return ar_estimate, ar_residuals, coef_ar
 
  
 def discritize_distribution(distribution_values, distribution_length, numRealizations, gradations):
-  new_values = np.zeros(distribution_length)
+  #this function finds the values at gradations + 1 evenly spaced levels of the distribution of realizations on each day (distribution_values is days x realizations)
+  #level z is the floor(numRealizations * z/gradations)th smallest realization, and the last level is the largest realization
+  #all the levels are found for every day at once with a single partition along the realization axis
+  distribution_values = np.asarray(distribution_values, dtype = float)[:distribution_length,:numRealizations]
+  level_index = []
+  for z in range(0, gradations):
+    level_index.append(int(np.floor(numRealizations * z/gradations)))
+  level_index.append(numRealizations - 1)
+  partitioned_values = np.partition(distribution_values, np.unique(level_index), axis = 1)
   ensemble_level_dict = {}
-  for z in range(0, gradations + 1):
-    ensemble_level_dict[str(z)] = np.zeros(distribution_length)
-    
-  for yy in range(0, distribution_length):
-    value_range = np.zeros(numRealizations)
-    for x in range(0, numRealizations):
-      value_range[x] = distribution_values[yy][x]
-    sorted_range = np.sort(value_range)
-    for z in range(0, gradations):
-      ensemble_level = int(np.floor(len(sorted_range) * z/gradations))
-      ensemble_level_dict[str(z)][yy] = sorted_range[ensemble_level]
-    ensemble_level_dict[str(gradations)][yy] = sorted_range[-1]
+  for z, ensemble_level in enumerate(level_index):
+    ensemble_level_dict[str(z)] = np.ascontiguousarray(partitioned_values[:,ensemble_level])
     
   return ensemble_level_dict
   
+def calculate_distribution_quantiles(distribution_values, quantile_list, realization_weights = None):
+  #this function finds the values at each quantile in quantile_list (e.g., [0.025, 0.5, 0.975]) of the distribution of realizations on each day (distribution_values is days x realizations)
+  #realization_weights are optional weights for each realization in a weighted ensemble
+  #the value at quantile q is the smallest realization with more than q of the total weight at or below it (the same rule as discritize_distribution for equally weighted realizations)
+  #the fraction of the total weight at or below each realization is compared to q with a small tolerance, so rounding in the cumulative sums of
+  #equal weights (e.g., ten weights of 0.1) does not move a quantile to the neighbouring realization - unweighted realizations use the same rule with fractions k/n
+  #returns a dictionary with the timeseries for each quantile, keyed by str(q)
+  quantile_tolerance = 1e-9
+  distribution_values = np.asarray(distribution_values, dtype = float)
+  num_realizations = distribution_values.shape[1]
+  quantile_values = {}
+  if realization_weights is None:
+    cumulative_fraction = np.arange(1, num_realizations + 1) / num_realizations
+    level_index = np.minimum(np.searchsorted(cumulative_fraction, np.asarray(quantile_list, dtype = float) + quantile_tolerance, side = 'right'), num_realizations - 1)
+    partitioned_values = np.partition(distribution_values, np.unique(level_index), axis = 1)
+    for quantile_level, ensemble_level in zip(quantile_list, level_index):
+      quantile_values[str(quantile_level)] = np.ascontiguousarray(partitioned_values[:,ensemble_level])
+  else:
+    value_order = np.argsort(distribution_values, axis = 1)
+    sorted_values = np.take_along_axis(distribution_values, value_order, axis = 1)
+    cumulative_weights = np.cumsum(np.asarray(realization_weights, dtype = float)[value_order], axis = 1)
+    cumulative_fraction = cumulative_weights / cumulative_weights[:,-1:]
+    day_index = np.arange(distribution_values.shape[0])
+    for quantile_level in quantile_list:
+      ensemble_level = np.minimum(np.sum(cumulative_fraction <= quantile_level + quantile_tolerance, axis = 1), num_realizations - 1)
+      quantile_values[str(quantile_level)] = sorted_values[day_index, ensemble_level]
+      
+  return quantile_values
+  
+def make_quantile_sketch(distribution_length, sketch_capacity):
+  #this function initializes a mergeable summary of the distribution of a daily value across realizations
+  #values are kept exactly (sorted for each day) until there are more than sketch_capacity of them, and are then compacted like a KLL sketch -
+  #each level holds sorted values with weight 2^level, and when a level is full every other value is moved up a level (with twice the weight)
+  quantile_sketch = {}
+  quantile_sketch['capacity'] = sketch_capacity
+  quantile_sketch['count'] = 0
+  quantile_sketch['compactions'] = 0
+  quantile_sketch['levels'] = [np.zeros((distribution_length, 0))]
+  #the minimum and maximum are always kept exactly
+  quantile_sketch['min'] = np.full(distribution_length, np.inf)
+  quantile_sketch['max'] = np.full(distribution_length, -np.inf)
+  return quantile_sketch
+
+def update_quantile_sketch(quantile_sketch, block_values):
+  #this function adds a block of realizations (distribution_length x block realizations) to a quantile sketch
+  quantile_sketch['count'] += block_values.shape[1]
+  quantile_sketch['min'] = np.minimum(quantile_sketch['min'], np.min(block_values, axis = 1))
+  quantile_sketch['max'] = np.maximum(quantile_sketch['max'], np.max(block_values, axis = 1))
+  level_values = np.sort(block_values, axis = 1)
+  level_num = 0
+  while level_values is not None:
+    if level_num == len(quantile_sketch['levels']):
+      quantile_sketch['levels'].append(np.zeros((level_values.shape[0], 0)))
+    merged_values = np.sort(np.concatenate([quantile_sketch['levels'][level_num], level_values], axis = 1), axis = 1, kind = 'stable')
+    if merged_values.shape[1] <= quantile_sketch['capacity']:
+      quantile_sketch['levels'][level_num] = merged_values
+      level_values = None
+    else:
+      #keep every other value (alternating between odd and even values so the compaction is not biased), with an odd value left at this level
+      num_kept = merged_values.shape[1] % 2
+      compact_offset = quantile_sketch['compactions'] % 2
+      quantile_sketch['compactions'] += 1
+      quantile_sketch['levels'][level_num] = merged_values[:,(merged_values.shape[1] - num_kept):]
+      level_values = merged_values[:,compact_offset:(merged_values.shape[1] - num_kept):2]
+      level_num += 1
+      
+def get_sketch_percentiles(quantile_sketch, gradations):
+  #this function finds the values at the same distribution percentiles as discritize_distribution from a quantile sketch
+  sketch_values = np.concatenate(quantile_sketch['levels'], axis = 1)
+  sketch_weights = np.concatenate([np.full(x.shape[1], 2 ** level_num) for level_num, x in enumerate(quantile_sketch['levels'])])
+  value_order = np.argsort(sketch_values, axis = 1, kind = 'stable')
+  sorted_values = np.take_along_axis(sketch_values, value_order, axis = 1)
+  cumulative_weights = np.cumsum(sketch_weights[value_order], axis = 1)
+  day_index = np.arange(sketch_values.shape[0])
+  ensemble_level_dict = {}
+  ensemble_level_dict['0'] = quantile_sketch['min'] * 1.0
+  for z in range(1, gradations):
+    ensemble_level = int(np.floor(quantile_sketch['count'] * z/gradations))
+    ensemble_level_dict[str(z)] = sorted_values[day_index, np.argmax(cumulative_weights > ensemble_level, axis = 1)]
+  ensemble_level_dict[str(gradations)] = quantile_sketch['max'] * 1.0
+  
+  return ensemble_level_dict
+  
 def calc_non_covid_icu(admissions_by_type, msdrg_by_type, period_range, admission_type_list, mdc_list):
   #get integer values of the start/end points for the different historical periods
 
@@ -973,13 +1783,41 @@ def calc_non_covid_icu(admissions_by_type, msdrg_by_type, period_range, admissio
           
   return msdrg_per_admit
 
-def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_ave_admissions, daily_admission_ratio, daily_ave_msdrg, daily_msdrg_ratio, covid_admission_timeseries, covid_icu_timeseries, icu_coefs, function_parameters, period_range, admission_type_list, mdc_list, observation_start_date, calibration_start_date, start_simulation, synthetic_length, total_icu_capacity):
+def make_category_matrix(category_values, admission_type_list, mdc_list, series_length = None):
+  #stack per-group values (keyed by admit type + '_' + mdc) into a (category x ...) array, with categories ordered like icu_coefs (mdc major, admit type minor)
+  category_list = []
+  for mdc_num in mdc_list:
+    for admit_type in admission_type_list:
+      if series_length is None:
+        category_list.append(np.asarray(category_values[admit_type + '_' + mdc_num], dtype = float))
+      else:
+        category_list.append(np.asarray(category_values[admit_type + '_' + mdc_num][:series_length], dtype = float))
+  return np.stack(category_list)
+
+def sum_categories(category_values, initial_value = 0.0):
+  #total over the first (category) axis, adding the categories one at a time to a running total that starts at initial_value
+  #(np.add.accumulate always adds in category order whatever the memory layout, np.sum can use pairwise summation), so totals are the same as adding up each category in a loop
+  return np.add.accumulate(np.concatenate([np.full((1,) + category_values.shape[1:], initial_value), category_values]), axis = 0)[-1]
+
+def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_ave_admissions, daily_admission_ratio, daily_ave_msdrg, daily_msdrg_ratio, covid_admission_timeseries, covid_icu_timeseries, icu_coefs, parameter_tensor, period_range, admission_type_list, mdc_list, observation_start_date, calibration_start_date, start_simulation, synthetic_length, total_icu_capacity, ensemble_seed = 11, realization_num = 0):
   #this function calculates non-covid admissions, msdrg per admission, and icu populations
   #timeseries are calculated based on 'triggers' that toggle elective surgical procedures on and off depending on the icu census values
+  #(the observed period is reconstructed with observe_icu_usage and the future is projected with project_icu_usage - when several covid scenarios
+  #are simulated for the same region, call observe_icu_usage once and project_icu_usage for each scenario)
+  observed_state = observe_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_ave_admissions, daily_admission_ratio, daily_ave_msdrg, daily_msdrg_ratio, icu_coefs, parameter_tensor, period_range, admission_type_list, mdc_list, observation_start_date, calibration_start_date, start_simulation, synthetic_length)
+  return project_icu_usage(observed_state, covid_admission_timeseries, covid_icu_timeseries, total_icu_capacity, ensemble_seed = ensemble_seed, realization_num = realization_num)
+
+def observe_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_ave_admissions, daily_admission_ratio, daily_ave_msdrg, daily_msdrg_ratio, icu_coefs, parameter_tensor, period_range, admission_type_list, mdc_list, observation_start_date, calibration_start_date, start_simulation, synthetic_length):
+  #this function reconstructs observed and 'estimated' non-covid admissions, msdrg per admission, and icu populations before start_simulation
+  #and fits the autoregressive residual models - none of this depends on the covid projection, so the returned observed_state
+  #(a dictionary of the observed/synthetic timeseries and everything project_icu_usage needs) can be projected under any number of covid scenarios
+  #admission curve parameters are read from the (period x category x target x [s, e, x, z]) parameter tensor (a function_parameters dictionary is converted with make_parameter_tensor)
+  if isinstance(parameter_tensor, dict):
+    parameter_tensor = make_parameter_tensor(parameter_tensor, admission_type_list, mdc_list)
+  #logit_s[period], logit_e[period], ... are the (category x target) parameters of each period (periods 1-3 are [0, 1, 2], targets are admissions = 0 and msdrg = 1)
+  logit_s, logit_e, logit_x, logit_z = np.moveaxis(parameter_tensor, -1, 0)
   day_start_index = observation_start_date.timetuple().tm_yday
   calibration_start_index = calibration_start_date.timetuple().tm_yday
-  capacity_counter = 0
-  begin_er_return = start_simulation + 15
   #get 'baseline' values for each admission group - this is approximating 'normal' conditions for the hospital
   baseline_period_slice = slice(period_range['3']['start'][0],period_range['3']['start'][1])
   baseline_admission_values = {}
@@ -988,6 +1826,11 @@ def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_
       admission_group = admit_type + '_' + mdc_num    
       baseline_admission_values[admission_group] =  np.mean(admissions_by_type[admission_group][baseline_period_slice])
   baseline_icu = np.mean(total_census['total_icu_census'][baseline_period_slice] - total_census['covid_icu_census'][baseline_period_slice])
+  #per-category values, with categories ordered like icu_coefs (mdc major, admit type minor) and the parameter tensor
+  baseline_admission_matrix = make_category_matrix(baseline_admission_values, admission_type_list, mdc_list)
+  icu_category_coefs = np.asarray(icu_coefs[:-1])
+  #expected admissions/msdrg on each day of the year (category x target x day of year), adjusted for levels observed in early 2020
+  expected_by_day = np.stack([make_category_matrix(daily_ave_admissions, admission_type_list, mdc_list) * make_category_matrix(daily_admission_ratio, admission_type_list, mdc_list)[:, np.newaxis], make_category_matrix(daily_ave_msdrg, admission_type_list, mdc_list) * make_category_matrix(daily_msdrg_ratio, admission_type_list, mdc_list)[:, np.newaxis]], axis = 1)
   #initialize timeseries arrays for observed and synthetic values of variables we are interested in
   observed_values = {}
   synthetic_values = {}
@@ -999,69 +1842,38 @@ def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_
         synthetic_values[type_use + '_' + syn_cat] = np.zeros(synthetic_length)
       else:
         synthetic_values[type_use + '_' + syn_cat] = np.ones(synthetic_length) * icu_coefs[-1]#intiailize with the linear cconstant from regression, rest of calc comes later
-  tot_covid_admissions = 0.0
-  tot_covid_msdrg = 0.0
-  for syn_x in range(0, start_simulation):
-    #set the 'period' of the observed data so we know which function to use to estimate non-covid admissions
-    period_num = '3'
-    for period_use in range(1, 4):
-      if syn_x < period_range[str(period_use)]['end'][0]:
-        period_num = str(period_use)
-        break
-    day_count = syn_x + day_start_index
-    if day_count >= 365:
-      day_count -= 365
-      
-    #what index day did the current 'period' start
-    start_date_function = period_range[period_num]['start'][0]
-      
-    #find observed and 'estimated' values for admissions, msdrg, and icu during the period for which we have observed data
-    observed_values['icu'][syn_x] = total_census['total_icu_census'][syn_x] - total_census['covid_icu_census'][syn_x]
-   
-    if observed_values['icu'][syn_x] < 1.0:
-      use_synthetic = True
-      observed_values['icu'][syn_x] = icu_coefs[-1]
-    else:
-      use_synthetic = False
-    for mdc_cnt, mdc_num in enumerate(mdc_list):
-      for adm_cnt, admit_type in enumerate(admission_type_list):      
-        admission_group = admit_type + '_' + mdc_num      
-        int_admission = admissions_by_type[admission_group][syn_x]
-        int_msdrg = msdrg_per_admit[admission_group][syn_x]
-        
-        if use_synthetic:
-          observed_values['icu'][syn_x] += (baseline_admission_values[admission_group] - int_admission) * icu_coefs[mdc_cnt * len(admission_type_list) + adm_cnt]
-        observed_values['admissions'][syn_x] += int_admission * 1.0
-        observed_values['msdrg'][syn_x] += int_msdrg
-        
-        synthetic_timestep = syn_x - start_date_function
-        param_use = 'P' + period_num + '_' + mdc_num + '_' + admit_type
-        #get synthetic admissions from this patient group
-        syn_admission_delta = estimate_logit_syn(synthetic_timestep, function_parameters['s_1'][param_use], function_parameters['e_1'][param_use], function_parameters['x_1'][param_use], function_parameters['z_1'][param_use])#calculate difference between actual admissions and expected admissions
-        syn_msdrg_per = estimate_logit_syn(synthetic_timestep, function_parameters['s_2'][param_use], function_parameters['e_2'][param_use], function_parameters['x_2'][param_use], function_parameters['z_2'][param_use])#calculate expected msdrg/admission
-        expected_admissions = daily_ave_admissions[admission_group][day_count] * daily_admission_ratio[admission_group]#calculate expected admissions for this day of the year
-        expected_msdrg = daily_ave_msdrg[admission_group][day_count] * daily_msdrg_ratio[admission_group]#calculate expected admissions for this day of the year
-        total_admissions = syn_admission_delta + expected_admissions
-        total_msdrg = syn_msdrg_per + expected_msdrg
-        #find synthetic values at timestep
-        for syn_cat in ['_action', '_no_action']:
-          synthetic_values['icu' + syn_cat][syn_x] += (baseline_admission_values[admission_group] - int_admission) * icu_coefs[mdc_cnt * len(admission_type_list) + adm_cnt]
-          synthetic_values['admissions' + syn_cat][syn_x] += total_admissions * 1.0
-          synthetic_values['msdrg' + syn_cat][syn_x] += total_msdrg * 1.0
-        synthetic_values['admissions_baseline'][syn_x] += expected_admissions   
-        synthetic_values['msdrg_baseline'][syn_x] += expected_msdrg   
-    
-    synthetic_values['msdrg_no_action'][syn_x] +=  msdrg_per_admit['COVID'][syn_x]
-    synthetic_values['msdrg_action'][syn_x] +=  msdrg_per_admit['COVID'][syn_x]
-    observed_values['msdrg'][syn_x] +=  msdrg_per_admit['COVID'][syn_x]
-    tot_covid_admissions += admissions_by_type['COVID'][syn_x]
-    tot_covid_msdrg += msdrg_per_admit['COVID'][syn_x]
-    synthetic_values['icu_action'][syn_x] = baseline_icu - synthetic_values['icu_action'][syn_x]
-    synthetic_values['icu_no_action'][syn_x] = baseline_icu - synthetic_values['icu_no_action'][syn_x]
-    if use_synthetic:
-      observed_values['icu'][syn_x] = baseline_icu - observed_values['icu'][syn_x]
-    for data_type in ['icu', 'admissions', 'msdrg']:
-      synthetic_values[data_type + '_errors'][syn_x] = observed_values[data_type][syn_x] - synthetic_values[data_type + '_action'][syn_x]
+  #the observed period is reconstructed for every (category x day) at once, totals over categories are made with sum_categories so they match the original day-by-day loop exactly
+  observed_days = np.arange(start_simulation)
+  day_count = observed_days + day_start_index
+  day_count = np.where(day_count >= 365, day_count - 365, day_count)
+  #set the 'period' of each observed day (first period that has not ended yet, otherwise period 3) so we know which function to use to estimate non-covid admissions
+  period_ends = np.asarray([period_range[str(period_use)]['end'][0] for period_use in range(1, 4)])
+  period_starts = np.asarray([period_range[str(period_use)]['start'][0] for period_use in range(1, 4)])
+  period_index = np.minimum(np.searchsorted(period_ends, observed_days, side = 'right'), 2)
+  synthetic_timestep = observed_days - period_starts[period_index]
+  #gather each category's daily series and the logit parameters of the period active on each day (category x target x day)
+  int_admission = make_category_matrix(admissions_by_type, admission_type_list, mdc_list, start_simulation)
+  int_msdrg = make_category_matrix(msdrg_per_admit, admission_type_list, mdc_list, start_simulation)
+  expected_values = expected_by_day[:, :, day_count]
+  syn_delta = estimate_logit_syn(synthetic_timestep, np.moveaxis(logit_s[period_index], 0, -1), np.moveaxis(logit_e[period_index], 0, -1), np.moveaxis(logit_x[period_index], 0, -1), np.moveaxis(logit_z[period_index], 0, -1))#difference between actual and expected admissions (target 0) and expected msdrg/admission (target 1)
+  #icu contributions start from the linear constant of the regression
+  observed_icu_estimate = baseline_icu - sum_categories((baseline_admission_matrix[:, np.newaxis] - int_admission) * icu_category_coefs[:, np.newaxis], initial_value = icu_coefs[-1])
+  covid_msdrg = np.asarray(msdrg_per_admit['COVID'][:start_simulation], dtype = float)
+  #find observed and 'estimated' values for admissions, msdrg, and icu during the period for which we have observed data
+  observed_values['icu'] = total_census['total_icu_census'][:start_simulation] - total_census['covid_icu_census'][:start_simulation]
+  observed_values['icu'] = np.where(observed_values['icu'] < 1.0, observed_icu_estimate, observed_values['icu'])
+  observed_values['admissions'] = sum_categories(int_admission)
+  observed_values['msdrg'] = sum_categories(int_msdrg) + covid_msdrg
+  synthetic_totals = sum_categories(syn_delta + expected_values)
+  for syn_cat in ['_action', '_no_action']:
+    synthetic_values['icu' + syn_cat][:start_simulation] = observed_icu_estimate
+    synthetic_values['admissions' + syn_cat][:start_simulation] = synthetic_totals[0]
+    synthetic_values['msdrg' + syn_cat][:start_simulation] = synthetic_totals[1] + covid_msdrg
+  synthetic_values['admissions_baseline'][:start_simulation], synthetic_values['msdrg_baseline'][:start_simulation] = sum_categories(expected_values)
+  for data_type in ['icu', 'admissions', 'msdrg']:
+    synthetic_values[data_type + '_errors'][:start_simulation] = observed_values[data_type] - synthetic_values[data_type + '_action'][:start_simulation]
+  tot_covid_admissions = sum_categories(np.asarray(admissions_by_type['COVID'][:start_simulation], dtype = float))
+  tot_covid_msdrg = sum_categories(covid_msdrg)
   #simulated icu census timeseries include residuals estimated based on a joint pdf w/ hospital admissions
   av_msdrg_per_admit = tot_covid_admissions / tot_covid_msdrg
   counter = 0
@@ -1078,10 +1890,10 @@ def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_
     counter += 1
 
   #simulated admissions and msdrg timeseries include residuals estimated from observed data with autoregressive functions
-  rng = np.random.default_rng(234123415125321)
-  ar_residual_distribution = {}
+  #(the residuals themselves are drawn in project_icu_usage, from the random stream of each realization)
+  ar_models = {}
   for type_use in ['admissions', 'msdrg', 'icu']:
-    ar_residual_distribution[type_use] = {}
+    ar_residual_distribution = {}
     if type_use == 'icu':
       ar_est, ar_res, ar_coef = make_ar_model(2, synthetic_values[type_use + '_errors'][(start_simulation-110):(start_simulation-70)])
     else:
@@ -1091,22 +1903,76 @@ def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_
     admit_bins_left = np.asarray(pd.qcut(pd.Series(ar_est), q = 5).cat.categories.left)
     admit_bins_right = np.asarray(pd.qcut(pd.Series(ar_est), q = 5).cat.categories.right)
     for lfb, rtb in zip(admit_bins_left, admit_bins_right):
-      ar_residual_distribution[type_use][rtb] = []
+      ar_residual_distribution[rtb] = []
       for hist_range in range(0, len(ar_est)):
         if ar_est[hist_range] >= lfb and ar_est[hist_range] < rtb:
-          ar_residual_distribution[type_use][rtb].append(ar_res[hist_range])
-    
+          ar_residual_distribution[rtb].append(ar_res[hist_range])
+    ar_models[type_use] = {'coef': ar_coef, 'bins_right': admit_bins_right, 'residuals': ar_residual_distribution}
+
+  #per-category values used on every projected day
+  observed_state = {}
+  observed_state['early_admissions'] = np.mean(make_category_matrix(admissions_by_type, admission_type_list, mdc_list, 10), axis = 1)
+  observed_state['average_expected_admissions'] = np.mean(make_category_matrix(daily_ave_admissions, admission_type_list, mdc_list), axis = 1) * make_category_matrix(daily_admission_ratio, admission_type_list, mdc_list)
+  observed_state['end_msdrg'] = estimate_logit_syn(0, logit_s[0, :, 1], logit_e[0, :, 1], logit_x[0, :, 1], logit_z[0, :, 1])
+  observed_state['parameter_tensor'] = parameter_tensor
+  observed_state['baseline_admission_matrix'] = baseline_admission_matrix
+  observed_state['icu_category_coefs'] = icu_category_coefs
+  observed_state['expected_by_day'] = expected_by_day
+  observed_state['baseline_icu'] = baseline_icu
+  observed_state['av_msdrg_per_admit'] = av_msdrg_per_admit
+  observed_state['icu_residual_distribution'] = icu_residual_distribution
+  observed_state['ar_models'] = ar_models
+  observed_state['observed_values'] = observed_values
+  observed_state['synthetic_values'] = synthetic_values
+  observed_state['period_range'] = period_range
+  observed_state['day_start_index'] = day_start_index
+  observed_state['start_simulation'] = start_simulation
+  observed_state['synthetic_length'] = synthetic_length
+
+  return observed_state
+
+def project_icu_usage(observed_state, covid_admission_timeseries, covid_icu_timeseries, total_icu_capacity, ensemble_seed = 11, realization_num = 0):
+  #this function projects non-covid admissions, msdrg per admission, and icu populations after start_simulation for one covid admission and icu trajectory,
+  #continuing the timeseries reconstructed by observe_icu_usage (observed_state is not changed, so it can be reused for other scenarios)
+  period_range = observed_state['period_range']
+  day_start_index = observed_state['day_start_index']
+  start_simulation = observed_state['start_simulation']
+  synthetic_length = observed_state['synthetic_length']
+  baseline_icu = observed_state['baseline_icu']
+  av_msdrg_per_admit = observed_state['av_msdrg_per_admit']
+  expected_by_day = observed_state['expected_by_day']
+  baseline_admission_matrix = observed_state['baseline_admission_matrix']
+  icu_category_coefs = observed_state['icu_category_coefs']
+  early_admissions = observed_state['early_admissions']
+  average_expected_admissions = observed_state['average_expected_admissions']
+  end_msdrg = observed_state['end_msdrg']
+  logit_s, logit_e, logit_x, logit_z = np.moveaxis(observed_state['parameter_tensor'], -1, 0)
+  begin_er_return = start_simulation + 15
+  observed_values = {}
+  for type_use in observed_state['observed_values']:
+    observed_values[type_use] = observed_state['observed_values'][type_use].copy()
+  synthetic_values = {}
+  for syn_cat in observed_state['synthetic_values']:
+    synthetic_values[syn_cat] = observed_state['synthetic_values'][syn_cat].copy()
+
+  #extend the residual timeseries with the autoregressive models
+  #(residuals are drawn from the random stream of this realization, see make_realization_rngs)
+  rng = make_realization_rngs(ensemble_seed, 2, [realization_num])[0]
+  for type_use in ['admissions', 'msdrg', 'icu']:
+    ar_coef = observed_state['ar_models'][type_use]['coef']
+    admit_bins_right = observed_state['ar_models'][type_use]['bins_right']
+    ar_residual_distribution = observed_state['ar_models'][type_use]['residuals']
     for xx in range(start_simulation, synthetic_length):
       found_bin = 0
       for rtb in admit_bins_right:
         if synthetic_values[type_use + '_errors'][xx] < rtb:
-          counter = min(int(rng.random() * len(ar_residual_distribution[type_use][rtb])), len(ar_residual_distribution[type_use][rtb]) - 1)
-          ar_error = ar_residual_distribution[type_use][rtb][counter] * 1.0
+          counter = min(int(rng.random() * len(ar_residual_distribution[rtb])), len(ar_residual_distribution[rtb]) - 1)
+          ar_error = ar_residual_distribution[rtb][counter] * 1.0
           found_bin = 1
           break
       if found_bin == 0:
-        counter = min(int(rng.random() * len(ar_residual_distribution[type_use][rtb])), len(ar_residual_distribution[type_use][rtb]) - 1)
-      ar_error = ar_residual_distribution[type_use][rtb][counter] * 1.0    
+        counter = min(int(rng.random() * len(ar_residual_distribution[rtb])), len(ar_residual_distribution[rtb]) - 1)
+      ar_error = ar_residual_distribution[rtb][counter] * 1.0    
       synthetic_values[type_use + '_errors'][xx] = synthetic_values[type_use + '_errors'][xx-1]*ar_coef[0] + synthetic_values[type_use + '_errors'][xx-2]*ar_coef[1] + ar_error      
    
   #simulate future after end of observations   
@@ -1171,88 +2037,39 @@ def simulate_icu_usage(total_census, admissions_by_type, msdrg_per_admit, daily_
     else:
       timestep_voluntary_reductions_na = syn_x - period_range['3']['start'][0]
     
-    #find observed and 'estimated' values for admissions, msdrg, and icu during the period for which we have observed data
-    for mdc_cnt, mdc_num in enumerate(mdc_list):
-      for adm_cnt, admit_type in enumerate(admission_type_list):   
-        #calculate admissions and msdrg per admit for each patient group and admit type (inpatient/er)      
-        admission_group = admit_type + '_' + mdc_num      
-        param_type = mdc_num + '_' + admit_type
-        #get synthetic admissions from this patient group
-        expected_admissions = daily_ave_admissions[admission_group][day_count] * daily_admission_ratio[admission_group]#calculate expected admissions for this day of the year
-        expected_msdrg = daily_ave_msdrg[admission_group][day_count] * daily_msdrg_ratio[admission_group]        
-        if use_recover_cancelled:
-          #the start values in this period depend on when it is triggered and must be calculated
-          trend_period_use = 'P3_' + param_type
-          start_admit_prev = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          start_msdrg_prev = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-          trend_period_use = 'P1_' + param_type
-          start_admit = estimate_logit_syn(timestep_cancelled_to_recovery, start_admit_prev, function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])
-          start_msdrg = estimate_logit_syn(timestep_cancelled_to_recovery, start_msdrg_prev, function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])
-          #estimate admissions/msdrg per admit from logit functions
-          end_admit = np.mean(admissions_by_type[admission_group][:10]) - expected_admissions
-          end_msdrg = estimate_logit_syn(0, function_parameters['s_2']['P1_' + param_type], function_parameters['e_2']['P1_' + param_type], function_parameters['x_2']['P1_' + param_type], function_parameters['z_2']['P1_' + param_type])
-          trend_period_use = 'P2_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_cancelled_recovery, start_admit, end_admit, function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_cancelled_recovery, start_msdrg, end_msdrg, function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-        elif use_recover_voluntary:
-          #the start values in this period depend on when it is triggered and must be calculated          
-          trend_period_use = 'P3_' + param_type
-          start_admit = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          start_msdrg = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-          end_admit = np.mean(admissions_by_type[admission_group][:10]) - expected_admissions
-          end_msdrg =  estimate_logit_syn(0, function_parameters['s_2']['P1_' + param_type], function_parameters['e_2']['P1_' + param_type], function_parameters['x_2']['P1_' + param_type], function_parameters['z_2']['P1_' + param_type])
-          #estimate admissions/msdrg per admit from logit functions
-          trend_period_use = 'P2_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_voluntary_recovery, start_admit, end_admit, function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_voluntary_recovery, start_msdrg, end_msdrg, function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission        
-        elif use_cancelled_procedures:
-          #start/end values are known, estimate admissions/msdrg per admit from logit functions
-          trend_period_use = 'P3_' + param_type
-          start_admit = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          start_msdrg = estimate_logit_syn(timestep_start_from_voluntary, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-          trend_period_use = 'P1_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_cancellations, start_admit, function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_cancellations, start_msdrg, function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-        else:
-          #start/end values are known, estimate admissions/msdrg per admit from logit functions
-          trend_period_use = 'P3_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_voluntary_reductions, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_voluntary_reductions, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-        
-        expected_admissions = daily_ave_admissions[admission_group][day_count] * daily_admission_ratio[admission_group]#calculate expected admissions for this day of the year
-        expected_msdrg = daily_ave_msdrg[admission_group][day_count] * daily_msdrg_ratio[admission_group]#calculate expected admissions for this day of the year
-        total_admissions = syn_admission_delta + expected_admissions
-        total_msdrg = syn_msdrg_per + expected_msdrg
-        #find synthetic values at timestep
-        synthetic_values['icu_action'][syn_x] += (baseline_admission_values[admission_group] - syn_admission_delta - np.mean(daily_ave_admissions[admission_group]) * daily_admission_ratio[admission_group]) * icu_coefs[mdc_cnt * len(admission_type_list) + adm_cnt]
-        synthetic_values['admissions_action'][syn_x] += total_admissions * 1.0
-        
-        synthetic_values['msdrg_action'][syn_x] += total_msdrg
-        synthetic_values['admissions_baseline'][syn_x] += expected_admissions    
-        synthetic_values['msdrg_baseline'][syn_x] += expected_msdrg
-
-        #find values of admission/msdrg in the 'no action' scenarios - same as above but there is no option to cancel procedures or recover from procedure cancellation        
-        if use_recovery_no_action:
-          trend_period_use = 'P3_' + param_type
-          start_admit = estimate_logit_syn(timestep_start_from_voluntary_na, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          start_msdrg = estimate_logit_syn(timestep_start_from_voluntary_na, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-          end_admit = np.mean(admissions_by_type[admission_group][:10]) - expected_admissions
-          end_msdrg =  estimate_logit_syn(0, function_parameters['s_2']['P1_' + param_type], function_parameters['e_2']['P1_' + param_type], function_parameters['x_2']['P1_' + param_type], function_parameters['z_2']['P1_' + param_type])
-          #estimate admissions/msdrg per admit from logit functions
-          trend_period_use = 'P2_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_voluntary_recovery_na, start_admit, end_admit, function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_voluntary_recovery_na, start_msdrg, end_msdrg, function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission        
-        else:
-          trend_period_use = 'P3_' + param_type
-          syn_admission_delta = estimate_logit_syn(timestep_voluntary_reductions_na, function_parameters['s_1'][trend_period_use], function_parameters['e_1'][trend_period_use], function_parameters['x_1'][trend_period_use], function_parameters['z_1'][trend_period_use])#calculate difference between actual admissions and expected admissions
-          syn_msdrg_per = estimate_logit_syn(timestep_voluntary_reductions_na, function_parameters['s_2'][trend_period_use], function_parameters['e_2'][trend_period_use], function_parameters['x_2'][trend_period_use], function_parameters['z_2'][trend_period_use])#calculate expected msdrg/admission
-        
-        total_admissions = syn_admission_delta + expected_admissions
-        total_msdrg = syn_msdrg_per + expected_msdrg
-        #find synthetic values at timestep
-        synthetic_values['icu_no_action'][syn_x] += (baseline_admission_values[admission_group] - syn_admission_delta - np.mean(daily_ave_admissions[admission_group]) * daily_admission_ratio[admission_group]) * icu_coefs[mdc_cnt * len(admission_type_list) + adm_cnt]
-        synthetic_values['admissions_no_action'][syn_x] += total_admissions * 1.0
-        synthetic_values['msdrg_no_action'][syn_x] += total_msdrg            
+    #find 'estimated' values for admissions and msdrg per admit of every (category x target) at this timestep, reading the parameters of each period from the parameter tensor
+    expected_values = expected_by_day[:, :, day_count]#expected admissions/msdrg for this day of the year
+    #recovery curves end at the admissions observed at the start of the record and the msdrg per admit at the start of period 1
+    end_values = np.column_stack([early_admissions - expected_values[:, 0], end_msdrg])
+    if use_recover_cancelled:
+      #the start values in this period depend on when it is triggered and must be calculated
+      start_values_prev = estimate_logit_syn(timestep_start_from_voluntary, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+      start_values = estimate_logit_syn(timestep_cancelled_to_recovery, start_values_prev, logit_e[0], logit_x[0], logit_z[0])
+      syn_delta = estimate_logit_syn(timestep_cancelled_recovery, start_values, end_values, logit_x[1], logit_z[1])
+    elif use_recover_voluntary:
+      #the start values in this period depend on when it is triggered and must be calculated
+      start_values = estimate_logit_syn(timestep_start_from_voluntary, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+      syn_delta = estimate_logit_syn(timestep_voluntary_recovery, start_values, end_values, logit_x[1], logit_z[1])
+    elif use_cancelled_procedures:
+      #start/end values are known, estimate admissions/msdrg per admit from logit functions
+      start_values = estimate_logit_syn(timestep_start_from_voluntary, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+      syn_delta = estimate_logit_syn(timestep_cancellations, start_values, logit_e[0], logit_x[0], logit_z[0])
+    else:
+      #start/end values are known, estimate admissions/msdrg per admit from logit functions
+      syn_delta = estimate_logit_syn(timestep_voluntary_reductions, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+    #find synthetic values at timestep
+    synthetic_values['icu_action'][syn_x] = sum_categories((baseline_admission_matrix - syn_delta[:, 0] - average_expected_admissions) * icu_category_coefs, initial_value = synthetic_values['icu_action'][syn_x])
+    synthetic_values['admissions_action'][syn_x], synthetic_values['msdrg_action'][syn_x] = sum_categories(syn_delta + expected_values)
+    synthetic_values['admissions_baseline'][syn_x], synthetic_values['msdrg_baseline'][syn_x] = sum_categories(expected_values)
+
+    #find values of admission/msdrg in the 'no action' scenarios - same as above but there is no option to cancel procedures or recover from procedure cancellation
+    if use_recovery_no_action:
+      start_values = estimate_logit_syn(timestep_start_from_voluntary_na, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+      syn_delta = estimate_logit_syn(timestep_voluntary_recovery_na, start_values, end_values, logit_x[1], logit_z[1])
+    else:
+      syn_delta = estimate_logit_syn(timestep_voluntary_reductions_na, logit_s[2], logit_e[2], logit_x[2], logit_z[2])
+    synthetic_values['icu_no_action'][syn_x] = sum_categories((baseline_admission_matrix - syn_delta[:, 0] - average_expected_admissions) * icu_category_coefs, initial_value = synthetic_values['icu_no_action'][syn_x])
+    synthetic_values['admissions_no_action'][syn_x], synthetic_values['msdrg_no_action'][syn_x] = sum_categories(syn_delta + expected_values)
             
     #add in daily series of random errors for each variable type
     synthetic_values['icu_action'][syn_x] = baseline_icu - synthetic_values['icu_action'][syn_x]
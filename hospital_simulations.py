@@ -5,7 +5,6 @@ import hospital_plots as hp
 import forecasts as frc
 import os
 
-np.random.seed(11)
 ######################################################
 #this file runs hospital pandemic capacity simulations
 #takes inpatient admissions, inpatient classification,
@@ -33,6 +32,9 @@ wwtp_systems = {}
 wwtp_systems['Charlotte'] = ['Charlotte Mecklenburg Utilities',]
 wwtp_systems['Triangle'] = ['Orange County Water and Sewer Authority', 'Town of Pittsboro', 'City of Raleigh', 'City of Durham', 'Durham County', 'Town of Cary', 'Town of Morrisville', 'Town of Wake Forest', 'Town of Apex']
 
+#every stochastic part of the simulations draws from random streams spawned from this seed (one stream per realization),
+#so results are reproducible regardless of the order or the number of processes the realizations are simulated with
+ensemble_seed = 11
 #set simulation timeframe
 start_value = datetime.strptime('03-01-2020', '%m-%d-%Y')
 end_value = datetime.strptime('01-31-2021', '%m-%d-%Y')
@@ -51,16 +53,22 @@ total_synthetic_length = start_simulation + 135
 #admissions - total
 #capacity - total, icu, ventilators, 'surge'
 print('     ......hospital census')
-regional_census_unc = frc.load_facilities(facility_list['UNC'], start_value, end_value, regional_name = 'UNC', show_plot = False)#UNC hospitals are the subset of hospitals for which we have detailed admissions data
-regional_census = frc.load_facilities(facility_list[simulation_region], start_value, end_value, regional_name = 'triangle', show_plot = False)
+#all regions are aggregated from a single load of the statewide data
+#cleaning_report - number of days each facility/metric was changed by data cleaning (drops in census that rebound, rescaling to final capacity)
+all_regional_census, cleaning_report = frc.load_regional_census(facility_list, start_value, end_value)
+regional_census_unc = all_regional_census['UNC']#UNC hospitals are the subset of hospitals for which we have detailed admissions data
+regional_census = all_regional_census[simulation_region]
+frc.write_regional_timeseries(regional_census_unc, 'UNC')
+frc.write_regional_timeseries(regional_census, 'triangle')
+frc.write_cleaning_report(cleaning_report, 'all_regions')
+print('          ' + str(int(cleaning_report.to_numpy().sum())) + ' facility census values changed by data cleaning (see covid_timeseries_agg/cleaned_census_cells_all_regions.csv)')
 #what are the system capacity ratios between UNC (detailed admission data) and the Triangle (analysis region)
 #use these ratios to scale up admissions data from UNC (assume a constant admission/capacity ratio between the regions)
 #capacity ratio between the study area and the unc-specific hospital system
 reg_cap_ratio = regional_census['total_capacity'][-1]/regional_census_unc['total_capacity'][-1]
 icu_cap_ratio = regional_census['total_icu_capacity'][-1]/regional_census_unc['total_icu_capacity'][-1]
 #load patient-level hospital data from UNC system
-#inpatient_data - detailed admissions of different inpatient types (MS-DRG), aggregated to daily values across the system
-inpatient_data = pd.read_csv('aggregated_inpatient_values.csv')
+#inpatient data (aggregated_inpatient_values.csv) - detailed admissions of different inpatient types (MS-DRG), aggregated to daily values across the system
 ms_drgs = pd.read_csv('ms_drgs.csv')
 #daily admissions, daily_msdrg - 56 x 365, for each MDC groups 1-26 (plus COVID & PRE) average number of patients & msdrg points being admitted via emergency room or scheduled procedures in each day of the year, 2018-19
 #daily_admissions_ratio, daily_msdrg_ratio - ratio of the number of patients and msdrg points admitted in Jan & Feb, 2020, compared to the average Jan & Feb 2018-19
@@ -72,11 +80,45 @@ mdc_list = []
 for mdc_num in range(1, 26):
   mdc_list.append(str(mdc_num).zfill(2))
 mdc_list.append('PRE')
+#Get survival probabilities for each oxygen-need category (survival is not live/die, but remaining in the hospital using a certain piece of equipment)
+#survival probabilities are expressed as % of the admitted cohort that is using that type of equipment as a function of the number of days after they were admitted
+#multiple cohorts enable multiple survival 'scenarios' for each hospital equipment type
+#survival_cohorts - dictionary with a key for each hospital equipment piece + probability source, that contains an array of the surival prob. as a function of time (cohort x day) for each 'scenario'
+prob_type_list = ['_low_probs_unc', '_low_probs', '_high_probs']
+machine_type_list = ['room_air', 'o2', 'icu', 'vents']
 
 #for regional admissions and total msdrg, calculate average seasonal values from 2018-2019, ratio of pre-covid 2020 to same dates i 2018 & 2019, AND
 #timeseries from 2018 - 2020 of admissions, msdrg, and msdrg per admission, and parameters for admission curves when elective procedures are cancelled, when hospital admissions decline voluntarily, and when admissions rebound
+#(the admission curves for each admit type are fit with scipy's curve_fit, in parallel with one worker process per cpu - use
+#calibration_method = 'batch' to fit all admit types together with the batched sigmoid fitter instead)
+#parameter_tensor - admission curve parameters as a (period x category x target x [s, e, x, z]) array, categories ordered like icu_coefs and targets are admissions/msdrg
+#(calibration_artifacts['function_parameters'] has the same parameters keyed by 'P' + period + '_' + mdc + '_' + admit type)
+#fit_report - dictionary with whether each admission ('_1') and msdrg ('_2') curve converged, and the sum of squared residuals of each fit
+#icu_coefs - coefficients to translate change in hospital admissions to change in icu census, each MDC + EI/IP admission type has a regression coefficient
+#calibration results are saved in the folder calibration_cache and are only recalculated when the input data or calibration settings change
 print('     ......patient distributions')
-daily_admissions, daily_msdrg, daily_admission_ratio, daily_msdrg_ratio, tot_admissions, tot_msdrg, msdrg_per_admit, function_parameters = frc.calibrate_msdrg_changes(inpatient_data, procedure_type_list, admission_type_list, mdc_list, period_index_dict, start_value, reg_cap_ratio)
+calibration_method = 'curve_fit'
+#the worker processes are only used by the curve_fit method, the batched fitter runs in this process
+if calibration_method == 'curve_fit':
+  calibration_workers = os.cpu_count()
+else:
+  calibration_workers = 1
+calibration_artifacts = frc.get_calibration_artifacts(regional_census, procedure_type_list, admission_type_list, mdc_list, period_index_dict, start_value, calibration_start_datetime, calibration_end_datetime, reg_cap_ratio, prob_type_list, machine_type_list, num_workers = calibration_workers, fit_method = calibration_method)
+daily_admissions = calibration_artifacts['daily_admissions']
+daily_msdrg = calibration_artifacts['daily_msdrg']
+daily_admission_ratio = calibration_artifacts['daily_admission_ratio']
+daily_msdrg_ratio = calibration_artifacts['daily_msdrg_ratio']
+tot_admissions = calibration_artifacts['tot_admissions']
+tot_msdrg = calibration_artifacts['tot_msdrg']
+msdrg_per_admit = calibration_artifacts['msdrg_per_admit']
+parameter_tensor = calibration_artifacts['parameter_tensor']
+fit_report = calibration_artifacts['fit_report']
+icu_coefs = calibration_artifacts['icu_coefs']
+survival_cohorts = calibration_artifacts['survival_cohorts']
+for report_key in ['converged_1', 'converged_2']:
+  failed_fits = [x for x in fit_report[report_key] if not fit_report[report_key][x]]
+  if len(failed_fits) > 0:
+    print('          ' + str(len(failed_fits)) + ' curves did not converge (' + report_key + '): ' + ', '.join(failed_fits))
 #make baseline admission plots
 #set average pre-covid admissions for each group of med/surg inpatient/emergency category
 pre_covid_baselines = {}  
@@ -87,23 +129,11 @@ for pro_type in procedure_type_list:
     pre_covid_baselines[typel + '_MSDRG'] = np.mean(tot_msdrg['baseline'][typel])
     pre_covid_baselines[typel + '_ADMIT'] = np.mean(tot_msdrg['baseline'][typel])
 
-#Get survival probabilities for each oxygen-need category (survival is not live/die, but remaining in the hospital using a certain piece of equipment)
-#survival probabilities are expressed as % of the admitted cohort that is using that type of equipment as a function of the number of days after they were admitted
-#multiple cohorts enable multiple survival 'scenarios' for each hospital equipment type
-#scenario_list - dictionary of lists of cohort/scenario 'names'
-#machine_survival_probabilities - dictionary with a key for each hospital equipment piece, that contains a surival prob. as a function of time for each 'scenario'
-prob_type_list = ['_low_probs_unc', '_low_probs', '_high_probs']
-machine_type_list = ['room_air', 'o2', 'icu', 'vents']
 print('     ......icu requirements')
-scenario_lists, machine_survival_probabilities = frc.get_admissions_standards(prob_type_list, machine_type_list)
 #this estimates historical patients using a ventilator in the unc system from the total admissions + the oxygen usage estimations b/c numbers are not good from hospital reporting alone
-unc_beds, unc_icu, unc_vents = frc.calculate_oxygen_usage(regional_census_unc['admissions'], 20, machine_survival_probabilities, scenario_lists, machine_type_list, '_low_probs_unc')
+unc_beds, unc_icu, unc_vents = frc.calculate_oxygen_usage(regional_census_unc['admissions'], 20, survival_cohorts, machine_type_list, '_low_probs_unc')
 regional_census_unc['vents_covid'] = unc_vents
 
-#Get coefficients to translate change in hospital admissions to change in icu census
-#each MDC + EI/IP admission type has a regression coefficient
-icu_coefs = frc.calibrate_icu_census(regional_census, tot_admissions['series'], start_value, calibration_start_datetime, calibration_end_datetime, admission_type_list, mdc_list)  
-
 #Make synthetic SEIHR series for future covid transmission under a 'high' and 'low' scenario
 #set total population of the study region
 total_pop = 1582112.0
@@ -113,20 +143,26 @@ days_extended = 10
 days_cutoff = 10
 #low tranmission scenario represents a decline in new infectious at the start of February
 print('project covid hospital demands')
-seir_ensemble_low, date_index = frc.make_synthetic_series(regional_census['admissions'], days_extended, days_cutoff, calibration_start_datetime, start_value, end_value, total_pop, start_simulation, total_synthetic_length)
-#calculate timeseries of the oxygen type usage from the synthetic (low) admissions series
-regional_beds_low, regional_icu_low, regional_vents_low = frc.calculate_oxygen_usage(seir_ensemble_low['h']['3'], 90, machine_survival_probabilities, scenario_lists, machine_type_list, '_low_probs')
+#seir_realizations_low - dictionary with the (days x realizations) matrix of each seihr component for every realization in the ensemble
+seir_ensemble_low, date_index, seir_realizations_low = frc.make_synthetic_series(regional_census['admissions'], days_extended, days_cutoff, calibration_start_datetime, start_value, end_value, total_pop, start_simulation, total_synthetic_length, ensemble_seed = ensemble_seed)
+#calculate timeseries of the oxygen type usage for every realization of the synthetic (low) admissions series
+#and use the median realization of the projected census (percentiles are taken after the oxygen usage projection)
+census_percentiles_low = frc.calculate_ensemble_oxygen_usage(seir_realizations_low['h'], 90, survival_cohorts, machine_type_list, '_low_probs')
+regional_beds_low, regional_icu_low, regional_vents_low = [x['3'] for x in census_percentiles_low]
 #high transmission scenario continues growth for another 30 days
 days_extended = 30
 days_cutoff = 10
 #high transmission scenario represents faster growth in January and slowdown at the end of February
-seir_ensemble_high, date_index = frc.make_synthetic_series(regional_census['admissions'], days_extended, days_cutoff, calibration_start_datetime, start_value, end_value, total_pop, start_simulation, total_synthetic_length)
-#calculate timeseries of the oxygen type usage from the synthetic (high) admissions series
-regional_beds_high, regional_icu_high, regional_vents_high = frc.calculate_oxygen_usage(seir_ensemble_high['h']['3'], 90, machine_survival_probabilities, scenario_lists, machine_type_list, '_low_probs')
+seir_ensemble_high, date_index, seir_realizations_high = frc.make_synthetic_series(regional_census['admissions'], days_extended, days_cutoff, calibration_start_datetime, start_value, end_value, total_pop, start_simulation, total_synthetic_length, ensemble_seed = ensemble_seed)
+#calculate timeseries of the oxygen type usage for every realization of the synthetic (high) admissions series
+census_percentiles_high = frc.calculate_ensemble_oxygen_usage(seir_realizations_high['h'], 90, survival_cohorts, machine_type_list, '_low_probs')
+regional_beds_high, regional_icu_high, regional_vents_high = [x['3'] for x in census_percentiles_high]
 #make plots of the seir model inputs/outputs
 print('simulate hospital actions')
-observed_timeseries_values, synthetic_timeseries_values_low = frc.simulate_icu_usage(regional_census, tot_admissions['series'], tot_msdrg['series'], daily_admissions, daily_admission_ratio, daily_msdrg, daily_msdrg_ratio, seir_ensemble_low['h']['3'], regional_icu_low, icu_coefs, function_parameters, period_index_dict, admission_type_list, mdc_list, start_value, calibration_start_datetime, start_simulation, total_synthetic_length, regional_census['total_icu_capacity'][-1])
-observed_timeseries_values, synthetic_timeseries_values_high = frc.simulate_icu_usage(regional_census, tot_admissions['series'], tot_msdrg['series'], daily_admissions, daily_admission_ratio, daily_msdrg, daily_msdrg_ratio, seir_ensemble_high['h']['3'], regional_icu_high, icu_coefs, function_parameters, period_index_dict, admission_type_list, mdc_list, start_value, calibration_start_datetime, start_simulation, total_synthetic_length, regional_census['total_icu_capacity'][-1])
+#the observed period (and the residual models) are the same for both scenarios, so they are calculated once and projected under each covid scenario
+observed_icu_state = frc.observe_icu_usage(regional_census, tot_admissions['series'], tot_msdrg['series'], daily_admissions, daily_admission_ratio, daily_msdrg, daily_msdrg_ratio, icu_coefs, parameter_tensor, period_index_dict, admission_type_list, mdc_list, start_value, calibration_start_datetime, start_simulation, total_synthetic_length)
+observed_timeseries_values, synthetic_timeseries_values_low = frc.project_icu_usage(observed_icu_state, seir_ensemble_low['h']['3'], regional_icu_low, regional_census['total_icu_capacity'][-1], ensemble_seed = ensemble_seed)
+observed_timeseries_values, synthetic_timeseries_values_high = frc.project_icu_usage(observed_icu_state, seir_ensemble_high['h']['3'], regional_icu_high, regional_census['total_icu_capacity'][-1], ensemble_seed = ensemble_seed)
 
 print('make plots')
 if not os.path.isdir('hospital_admissions'):